@@ -82,11 +82,11 @@ def _main():
         'total_required': event_opt._target,
         'remaining': event_opt._remaining,
         'runs': runs,
-        'ap': 40*sum(runs.values()),
+        'ap': event_opt.total_ap(runs),
     })
     print(_json({
         'runs': runs,
-        'ap': 40*sum(runs.values()),
+        'ap': event_opt.total_ap(runs),
         'total_runs': sum(runs.values())
     }))
 
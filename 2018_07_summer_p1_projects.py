@@ -112,7 +112,7 @@ def _main():
     runs = optimiser.optimise_runs()
     print(_json({
         'runs': runs,
-        'ap': 40*sum(runs.values())
+        'ap': optimiser.total_ap(runs)
     }))
 
 
@@ -50,6 +50,7 @@ def _main(n=100):
     )
 
     all_farming_nodes = [farming_nodes_1, farming_nodes_2]
+    all_ap_costs = [30, 40]
 
     SELECTED_INDEX = 1
 
@@ -69,8 +70,6 @@ def _main(n=100):
             parties[loc][type_] = \
                 [x.friendly_name(True) for x in parties[loc][type_]]
 
-    AP = 30 if SELECTED_INDEX == 0 else 40
-
     event_opt.set_current(Items(
         blue=167,
         gold=437,
@@ -85,7 +84,7 @@ def _main(n=100):
         cement=0,
         oil=0
     ))
-    event_opt.set_farming_nodes(these_nodes)
+    event_opt.set_farming_nodes(these_nodes, all_ap_costs[SELECTED_INDEX])
 
     runs = event_opt.optimise_runs()
     result_text = _json({
@@ -95,13 +94,13 @@ def _main(n=100):
         'remaining': event_opt._remaining,
         'projects': project_data[0]['projects'],
         'runs': runs,
-        'ap': AP*sum(runs.values()),
+        'ap': event_opt.total_ap(runs),
     })
     print(_json({
         'projects': project_data[0]['projects'],
         'runs': runs,
         'STAGE': SELECTED_INDEX,
-        'ap': AP*sum(runs.values()),
+        'ap': event_opt.total_ap(runs),
         'total_runs': sum(runs.values())
     }))
     
@@ -1,4 +1,7 @@
 import imagesearch
+import profiling
+import screenstate
+import sys
 import time
 import pyautogui
 from collections import namedtuple, defaultdict
@@ -20,27 +23,53 @@ UPDATE = 'images/update.png'
 SCROLL = 'images/scroll.png'
 START = 'images/start.png'
 
+SCREEN_STATES = {
+    'results': ('images/bond.png', 0.85),
+    'tap': ('images/please_tap.png', 0.85),
+    'battle': ('images/battle_menu.png', 0.85),
+    'next': ('images/next.png', 0.85),
+    'close': ('images/close.png', 0.85),
+    'request': ('images/request.png', 0.85),
+    'menu': (MENU, 0.85),
+}
+
 def found(pos):
     return pos[0] != -1
 
 def find(image, p=None):
-    return imagesearch.imagesearch(image, precision=(p or 0.85))
+    return imagesearch.imagesearch_roi(image, precision=(p or 0.85))
 
 def click(image, pos):
     return imagesearch.click_image(image, pos, 'left', 0.25)
 
+def mouse(func, *args):
+    # goes through the action queue so that it runs after any clicks 
+    # still queued, rather than at the same time on this thread.
+    imagesearch.actions.submit(_mouse, func, args)
+
+def _mouse(func, args):
+    func(*args)
+    imagesearch.frames.invalidate()
+
 def pause():
     time.sleep(1)
 
 def find_loop(image, p=None):
     print('Waiting for', image)
     result = find(image, p)
-    while not found(result):
-        time.sleep(0.5)
-        result = find(image, p)
+    if not found(result):
+        start = time.perf_counter()
+        result = screenstate.wait_for_image(image, p or 0.85)
+        profiling.record_wait(image, time.perf_counter() - start)
     print('Found', image)
     return result
 
+def click_state(state, previous):
+    image, p = SCREEN_STATES[state]
+    pos = find(image, p)
+    if found(pos):
+        click(image, pos)
+
 def click_loop(image, p=None):
     click(image, find_loop(image, p))
 
@@ -54,9 +83,9 @@ def click_waver():
                 return
             print('Scrolling...')
             click_loop(SCROLL)
-            pyautogui.mouseDown()
-            pyautogui.moveRel(0, 60, 2)
-            pyautogui.mouseUp()
+            mouse(pyautogui.mouseDown)
+            mouse(pyautogui.moveRel, 0, 60, 2)
+            mouse(pyautogui.mouseUp)
             pause()
 
         print('Updating supports...')
@@ -76,12 +105,12 @@ def click_attack():
 
 def arash_stella():
     click_loop(i('arash_np'))
-    pyautogui.moveRel(0, 250, 0.25)
-    pyautogui.click()
-    pyautogui.moveRel(150, 0, 0.25)
-    pyautogui.click()
+    mouse(pyautogui.moveRel, 0, 250, 0.25)
+    mouse(pyautogui.click)
+    mouse(pyautogui.moveRel, 150, 0, 0.25)
+    mouse(pyautogui.click)
 
-Card = namedtuple('Card', ('servant', 'type', 'image', 'pos'))
+Card = namedtuple('Card', ('servant', 'type', 'image', 'pos', 'score'))
 
 def sort_cards(cards: list):
     strength = {
@@ -96,45 +125,93 @@ cards = list(product(
     ('buster', 'quick', 'arts')
 ))
 
-def find_multiple(image, p=0.85):
-    seen = set()
-    im = pyautogui.screenshot()
-    #im.save('testarea.png') usefull for debugging purposes, this will save the captured region as "testarea.png"
-    img_rgb = np.array(im)
-    img_gray = cv2.cvtColor(img_rgb, cv2.COLOR_BGR2GRAY)
-    template = cv2.imread(image, 0)
-    template.shape[::-1]
-
-    res = cv2.matchTemplate(img_gray, template, cv2.TM_CCOEFF_NORMED)
-    res = np.where(res >= p)
-    seen = set()
-    near = lambda pt: (pt[0]//50, pt[1]//50)
-    filtered = []
-    for pt in zip(*res[::-1]):
-        if any((pt[0]-x0)**2 + (pt[1]-y0)**2 < 30**2 for x0, y0 in seen):
-            continue
-        seen.add(pt)
-    print('Found multiple', image, seen)
-    
-    return seen
+class CardDetector:
+    # Finds the command card slots with one full screen sweep, then on later 
+    # turns only classifies the small area around each known slot against 
+    # every card template. The slots never move, so once learned they are 
+    # kept even when some cards are not recognised yet.
+    def __init__(self, card_types, n=5, p=0.8, margin=10, min_distance=30,
+            max_tries=40):
+        self.n = n
+        self.p = p
+        self.max_tries = max_tries
+        self.margin = margin
+        self.min_distance = min_distance
+        self.card_types = [(s, t, i('cards/'+s+'_'+t)) for s, t in card_types]
+        self.slots = None
+
+    def _templates(self):
+        for servant, type_, image in self.card_types:
+            try:
+                yield servant, type_, image, imagesearch.templates.get(image)
+            except FileNotFoundError as e: 
+                print((servant, type_), 'errored')
+
+    def _sweep(self, frame):
+        candidates = []
+        for servant, type_, image, template in self._templates():
+            for x, y, score in imagesearch.imagesearch_all(
+                    image, self.p, self.min_distance, frame):
+                candidates.append(Card(servant, type_, image, (x, y), score))
+        if not candidates:
+            return []
+
+        # the same card matches several similar templates.
+        xs, ys = np.array([c.pos for c in candidates]).T
+        scores = np.array([c.score for c in candidates])
+        kept = imagesearch.suppress(xs, ys, scores, self.min_distance)
+        found = [candidates[i] for i in kept[:self.n]]
+        return sorted(found, key=lambda c: c.pos)
+
+    def _classify(self, frame, slot):
+        x0 = max(slot[0] - self.margin, 0)
+        y0 = max(slot[1] - self.margin, 0)
+        best = None
+        for servant, type_, image, template in self._templates():
+            h, w = template.shape
+            area = frame[y0:slot[1]+h+self.margin, x0:slot[0]+w+self.margin]
+            if area.shape[0] < h or area.shape[1] < w:
+                continue
+            start = time.perf_counter()
+            res = cv2.matchTemplate(area, template, cv2.TM_CCOEFF_NORMED)
+            min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
+            imagesearch.report_search(image, 
+                (x0, y0, x0+area.shape[1], y0+area.shape[0]), max_val, self.p, 
+                time.perf_counter() - start)
+            if best is None or max_val > best.score:
+                best = Card(servant, type_, image, 
+                    (x0+max_loc[0], y0+max_loc[1]), max_val)
+        return best
+
+    # The cards recognised in this frame, in slot order. Sweeps the whole 
+    # screen only until all n slots have been learned.
+    def detect(self, frame):
+        if self.slots is None:
+            found = self._sweep(frame)
+            if len(found) == self.n:
+                self.slots = [c.pos for c in found]
+            return found
+        found = [self._classify(frame, slot) for slot in self.slots]
+        return [c for c in found if c is not None and c.score >= self.p]
+
+card_detector = CardDetector(cards)
 
 def detect_cards():
-    found = []
-    p = 0.8
-    target = 5
-    while len(found) != target:
-        found.clear()
-        for card in cards:
-            image = i('cards/'+'_'.join(card))
-            try:
-                for pos in find_multiple(image, p=p):
-                    found.append(Card(card[0], card[1], image, pos))
-            except AttributeError as e: 
-                print(card, 'errored')
-        old_p = p
-        p += (len(found)-target)*0.025
-        p = min(0.9, p)
-        print('Corrected p', old_p, p)
+    # waits on new frames until all the cards are recognised, giving up 
+    # with what was found after max_tries frames.
+    d = card_detector
+    found = d.detect(imagesearch.frames.grab())
+    for tries in range(d.max_tries):
+        if len(found) == d.n:
+            break
+        print('Found', len(found), 'cards, waiting')
+        time.sleep(0.25)
+        imagesearch.frames.invalidate()
+        found = d.detect(imagesearch.frames.grab())
+    if len(found) != d.n:
+        print('Only found', len(found), 'cards')
+    for c in found:
+        print('Card', c.servant, c.type, c.pos, round(c.score, 3))
     return found
 
 def click_cards(cards):
@@ -208,99 +285,107 @@ def face_card():
 def run_snowflakes():
     start_time = time.time()
 
-    click_loop(SNOWFLAKES, p=0.7)
-    time.sleep(2)
-    ap = find(AP)
-    
-    if found(ap):
-        click(AP, ap)
-        click(OK, find_loop(OK))
-
-    find_loop(SUPPORT)
-    click_waver()
+    with profiling.phase('quest start'):
+        click_loop(SNOWFLAKES, p=0.7)
+        time.sleep(2)
+        ap = find(AP)
+        
+        if found(ap):
+            click(AP, ap)
+            click(OK, find_loop(OK))
 
-    click_loop(START)
-    click_loop(i('arash_np_up'))
-    pause()
-    click_loop(i('attack'))
-    arash_stella()
-
-    find_loop(i('wave_2'))
-    
-    for s in ('atk', 'def', 'proj', 'np'):
-        click_skill(s)
-    click_attack()
-
-    click_loop(i('chloe_np'))
-    wave_cards(('chloe', 'scat'))
-
-    while True:    
-        find_loop(i('battle_menu'))
-        if found(find(i('wave 2'))):
-            face_card()
-        else:
-            break
-    for s in ('target', 'pierce', 'evade', 'crit'):
-        click_skill(s)
-    click_skill('on_scat')
-    click_skill('master')
-    click_skill('atk_master')
-    click_skill('master')
-    click_skill('gandr')
-    click_skill('master')
-    click_skill('change')
-    
-    click_loopi('waver_icon')
-    click_loopi('scathach_icon')
-    click_loopi('replace')
-
-    click_skill('quick')
-    click_skill('on_scat')
-
-    click_attack()
-
-    click_loopi('scat_np')
-    wave_cards(('scat', ))
+    with profiling.phase('support select'):
+        find_loop(SUPPORT)
+        click_waver()
+        click_loop(START)
 
-    while True:
-        bond = found(find(i('bond')))
-        tap = found(find(i('please_tap')))
-        battle = found(find(i('battle_menu')))
+    with profiling.phase('wave 1'):
+        click_loop(i('arash_np_up'))
         pause()
-        if bond or tap:
-            break
-        elif battle:
-            face_card()
+        click_loop(i('attack'))
+        arash_stella()
+
+    with profiling.phase('wave 2'):
+        find_loop(i('wave_2'))
+        
+        for s in ('atk', 'def', 'proj', 'np'):
+            click_skill(s)
+        click_attack()
+
+        click_loop(i('chloe_np'))
+        wave_cards(('chloe', 'scat'))
+
+        while True:    
+            find_loop(i('battle_menu'))
+            if found(find(i('wave 2'))):
+                face_card()
+            else:
+                break
+
+    with profiling.phase('wave 3'):
+        for s in ('target', 'pierce', 'evade', 'crit'):
+            click_skill(s)
+        click_skill('on_scat')
+        click_skill('master')
+        click_skill('atk_master')
+        click_skill('master')
+        click_skill('gandr')
+        click_skill('master')
+        click_skill('change')
+        
+        click_loopi('waver_icon')
+        click_loopi('scathach_icon')
+        click_loopi('replace')
+
+        click_skill('quick')
+        click_skill('on_scat')
+
+        click_attack()
+
+        click_loopi('scat_np')
+        wave_cards(('scat', ))
+
+        watcher = screenstate.ScreenWatcher(
+            (name, SCREEN_STATES[name]) for name in ('results', 'tap', 'battle'))
+        # the next turn's battle menu may come up between two ticks, with 
+        # no state change to show for it.
+        watcher.on('battle', lambda state, previous: face_card(), repeat=3)
+        watcher.run(lambda state: state in ('results', 'tap'))
     
-    while True:
-        close = find(i('close'))
-        next_button = find(i('next'))
-        if found(next_button):
-            click(i('next'), next_button)
-            pyautogui.moveRel(0, -100, 1)
-            break
-        elif found(close):
-            click(i('close'), close)
-            continue
-        pyautogui.click()
-        pause()
-        pause()
-
-    while True:
-        request = find(i('request'))
-        menu = find(MENU)
-        if found(menu):
-            break 
-        elif found(request):
-            click(i('request'), request)
-        pyautogui.click()
-        pause()
+    with profiling.phase('results'):
+        watcher = screenstate.ScreenWatcher(
+            (name, SCREEN_STATES[name]) 
+            for name in ('menu', 'next', 'close', 'request'))
+        watcher.on(None, lambda state, previous: mouse(pyautogui.click), 
+            repeat=2)
+        watcher.on('next', click_state)
+        watcher.on('next', 
+            lambda state, previous: mouse(pyautogui.moveRel, 0, -100, 1))
+        watcher.on('close', click_state, repeat=2)
+        watcher.on('request', click_state, repeat=2)
+        watcher.wait_for('menu')
 
     return time.time() - start_time
 
-if __name__ == '__main__':
+def run_forever(profiler=None):
     times = []
     while True:
         times.append(run_snowflakes()/60)
         print('Previous run:', times[-1], 'minutes')
-        print(f'Average of {len(times)} runs:', sum(times)/len(times), 'minutes')
\ No newline at end of file
+        print(f'Average of {len(times)} runs:', sum(times)/len(times), 'minutes')
+        if profiler is not None:
+            profiler.to_csv('profile.csv')
+            profiler.to_json('profile.json')
+            profiler.new_run()
+
+if __name__ == '__main__':
+    imagesearch.templates.preload('images', 'images/cards')
+    imagesearch.regions.load('images/regions.json')
+    if '--async' in sys.argv:
+        imagesearch.frames.start_capture()
+        imagesearch.actions.start()
+    if '--profile' in sys.argv:
+        with profiling.Profiler() as profiler:
+            run_forever(profiler)
+    else:
+        run_forever()
\ No newline at end of file
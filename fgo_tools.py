@@ -1,14 +1,17 @@
-from collections import OrderedDict, defaultdict
+from collections import OrderedDict, defaultdict, namedtuple
 from typing import Union
 from itertools import count
 
+import functools
 import json
 import math
 
+import numpy as np
+
 from ortools.linear_solver import pywraplp
 
-__all__ = ['Items', 'PartySetup', 'DropsData', 'EventOptimiser',
-    'SummerProjectsOptimiser']
+__all__ = ['Items', 'MaterialIndex', 'ItemsArray', 'PartySetup', 'DropsData', 
+    'EventOptimiser', 'PartyEventOptimiser', 'SummerProjectsOptimiser']
 
 _json_encoder = None
 
@@ -39,6 +42,10 @@ class Items(defaultdict):
     def __sub__(self, other):
         return self + (-other)
 
+    def __reduce__(self):
+        # the default factory is a lambda, which cannot be pickled.
+        return (self.__class__, (dict(self), ))
+
     def __repr__(self):
         return self.__class__.__name__+'('+', '.join(
             x+'='+repr(y) for (x, y) in self.items() if y != 0) + ')'
@@ -56,6 +63,143 @@ class Items(defaultdict):
             return plus+'0'
         return ', '.join(bonus_strings)
 
+class MaterialIndex:
+    """Registry assigning each material name a fixed position in the 
+    vectors used by ItemsArray. New names are appended as they are seen."""
+
+    def __init__(self, names=()):
+        self._names = []
+        self._positions = {}
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __contains__(self, name):
+        return name in self._positions
+
+    def add(self, name):
+        if name not in self._positions:
+            self._positions[name] = len(self._names)
+            self._names.append(name)
+        return self._positions[name]
+
+    def position(self, name):
+        return self._positions[name]
+
+materials = MaterialIndex()
+
+
+class ItemsArray:
+    """Items, or a batch of Items, stored as NumPy vectors over a 
+    MaterialIndex.
+
+    A 1-d array holds a single Items and a 2-d array holds one Items per 
+    row. Which materials were explicitly present is tracked alongside the 
+    values so that to_items() gives back the same keys that went in."""
+
+    def __init__(self, values, present=None, index: MaterialIndex=None):
+        self.index = materials if index is None else index
+        self.values = np.asarray(values)
+        if present is None:
+            present = self.values != 0
+        self.present = np.asarray(present, dtype=bool)
+
+    @classmethod
+    def from_items(cls, items, index: MaterialIndex=None):
+        return cls.stack([items], index)[0]
+
+    @classmethod
+    def stack(cls, items_list, index: MaterialIndex=None):
+        index = materials if index is None else index
+        positions = [[index.add(mat) for mat in items] 
+            for items in items_list]
+        is_int = all(isinstance(num, int) 
+            for items in items_list for num in items.values())
+
+        values = np.zeros((len(items_list), len(index)), 
+            dtype=np.int64 if is_int else np.float64)
+        present = np.zeros(values.shape, dtype=bool)
+        for row, (items, cols) in enumerate(zip(items_list, positions)):
+            values[row, cols] = list(items.values())
+            present[row, cols] = True
+        return cls(values, present, index)
+
+    def _padded(self):
+        missing = len(self.index) - self.values.shape[-1]
+        if not missing:
+            return self.values, self.present
+        pad = [(0, 0)] * (self.values.ndim - 1) + [(0, missing)]
+        return np.pad(self.values, pad), np.pad(self.present, pad)
+
+    def _combine(self, other, op):
+        if not isinstance(other, ItemsArray):
+            other = self.from_items(other, self.index)
+        assert other.index is self.index
+        values, present = self._padded()
+        other_values, other_present = other._padded()
+        return ItemsArray(op(values, other_values), 
+            present | other_present, self.index)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, key):
+        return ItemsArray(self.values[key], self.present[key], self.index)
+
+    def __add__(self, other):
+        return self._combine(other, np.add)
+
+    def __sub__(self, other):
+        return self._combine(other, np.subtract)
+
+    def __neg__(self):
+        return ItemsArray(-self.values, self.present, self.index)
+
+    def __mul__(self, scale):
+        scale = np.asarray(scale)
+        if scale.ndim == 1 and self.values.ndim == 2:
+            # one scale per row of the batch.
+            scale = scale[:, np.newaxis]
+        return ItemsArray(self.values * scale, self.present, self.index)
+
+    __rmul__ = __mul__
+
+    def sum(self):
+        """Adds the rows of a batch together."""
+        return ItemsArray(self.values.sum(axis=0), self.present.any(axis=0), 
+            self.index)
+
+    def weighted_sum(self, weights):
+        """Adds the rows of a batch together, scaling each row by the 
+        corresponding weight. Rows with a weight of 0 are left out."""
+        weights = np.asarray(weights)
+        values, present = self._padded()
+        return ItemsArray(weights @ values, 
+            (weights != 0) @ present, self.index)
+
+    def non_zero(self):
+        return np.any(self.values != 0, axis=-1)
+
+    def magnitude(self):
+        return np.sqrt(np.sum(np.square(self.values, dtype=np.float64), 
+            axis=-1))
+
+    def to_items(self):
+        if self.values.ndim == 2:
+            return [row.to_items() for row in self]
+        values, present = self._padded()
+        return Items((name, values[i].item()) 
+            for i, name in enumerate(self.index) if present[i])
+
+    def __repr__(self):
+        return self.__class__.__name__+'('+repr(self.to_items())+')'
+
+
 class PartySetup(dict):
     def __init__(self, servants=None, craft_essences=None, support=None):
         if servants is None:
@@ -85,29 +229,141 @@ class PartySetup(dict):
 
 
 class DropsData: 
+    """Drop rates per location, as the nested JSON dict of 
+    {location: {item: {'initial': ..., 'stacks': ...}}}.
+
+    Drops per run may also be given as a distribution, with the optional 
+    per-run 'initial_variance' and 'stacks_variance' of the drops without 
+    bonus and of the number of stacks, and their 'covariance'. Instead, 
+    'samples' can list observed runs as [drops without bonus, stacks] 
+    pairs, from which the means and variances are estimated.
+
+    The data is also kept as dense locations x materials matrices so that 
+    drops for many locations and bonuses can be computed at once with 
+    drops_matrix()."""
+
     def __init__(self, data):
         self._data = data
+        self.locations = list(data)
+        self.materials = MaterialIndex(
+            item for location_drops in data.values() for item in location_drops)
+        self._location_positions = {
+            loc: i for i, loc in enumerate(self.locations)}
+
+        shape = (len(self.locations), len(self.materials))
+        self._initial = np.zeros(shape)
+        self._stacks = np.zeros(shape)
+        self._initial_variance = np.zeros(shape)
+        self._stacks_variance = np.zeros(shape)
+        self._covariance = np.zeros(shape)
+        # item columns of each location, in the order of the original data.
+        self._columns = []
+        for i, location_drops in enumerate(data.values()):
+            columns = OrderedDict()
+            for item, item_drops in location_drops.items():
+                j = columns[item] = self.materials.position(item)
+                if 'samples' in item_drops:
+                    item_drops = dict(self._sample_moments(
+                        item_drops['samples']), **item_drops)
+                self._initial[i, j] = item_drops['initial']
+                self._stacks[i, j] = item_drops['stacks']
+                self._initial_variance[i, j] = \
+                    item_drops.get('initial_variance', 0)
+                self._stacks_variance[i, j] = \
+                    item_drops.get('stacks_variance', 0)
+                self._covariance[i, j] = item_drops.get('covariance', 0)
+            self._columns.append(columns)
+
+    @staticmethod
+    def _sample_moments(samples):
+        samples = np.asarray(samples, dtype=float)
+        mean = samples.mean(axis=0)
+        if len(samples) > 1:
+            cov = np.cov(samples, rowvar=False)
+        else:
+            cov = np.zeros((2, 2))
+        return {
+            'initial': mean[0].item(),
+            'stacks': mean[1].item(),
+            'initial_variance': cov[0, 0].item(),
+            'stacks_variance': cov[1, 1].item(),
+            'covariance': cov[0, 1].item(),
+        }
+
+    def bonus_vectors(self, bonuses):
+        """Converts an Items, or a list of Items, into bonus vectors over 
+        this data's materials. Bonuses for materials which never drop are 
+        ignored."""
+        if isinstance(bonuses, dict):
+            return self.bonus_vectors([bonuses])[0]
+        vectors = np.zeros((len(bonuses), len(self.materials)))
+        for row, bonus in enumerate(bonuses):
+            for item, num in bonus.items():
+                if item in self.materials:
+                    vectors[row, self.materials.position(item)] = num
+        return vectors
+
+    def drops_matrix(self, bonuses=None, locations=None):
+        """Returns expected drops per run as a locations x materials matrix.
+
+        bonuses may be None, a single bonus (Items or vector) applied to 
+        every location, or a 2-d array of one bonus vector per location. 
+        A 3-d array of shape (batch, locations, materials), or a batch of 
+        single bonus vectors of shape (batch, 1, materials), gives a batch 
+        of drop matrices."""
+        rows = slice(None) if locations is None else \
+            [self._location_positions[loc] for loc in locations]
+        if bonuses is None:
+            return self._initial[rows].copy()
+        if isinstance(bonuses, dict):
+            bonuses = self.bonus_vectors(bonuses)
+        return self._initial[rows] + bonuses * self._stacks[rows]
+
+    def variance_matrix(self, bonuses=None, locations=None):
+        """Returns the variance of drops per run as a locations x materials 
+        matrix, taking bonuses and locations as drops_matrix() does."""
+        rows = slice(None) if locations is None else \
+            [self._location_positions[loc] for loc in locations]
+        if bonuses is None:
+            return self._initial_variance[rows].copy()
+        if isinstance(bonuses, dict):
+            bonuses = self.bonus_vectors(bonuses)
+        return self._initial_variance[rows] \
+            + bonuses**2 * self._stacks_variance[rows] \
+            + 2 * bonuses * self._covariance[rows]
+
+    def _row_items(self, location, row):
+        return Items((item, row[j].item()) for item, j 
+            in self._columns[self._location_positions[location]].items())
 
     def drops_with_bonus(self, location, bonuses: Items=None):
-        location_drops = self._data[location]
+        i = self._location_positions[location]
         if bonuses is None:
             bonuses = Items()
-
-        drops = Items()
-        for item, item_drops in location_drops.items():
-            drops[item] = item_drops['initial'] + bonuses[item] * item_drops['stacks']
-        return drops
+        row = self._initial[i] + self.bonus_vectors(bonuses) * self._stacks[i]
+        return self._row_items(location, row)
 
     def drops_with_party(self, location, party: PartySetup):
         return self.drops_with_bonus(location, party.total_bonus())
 
+    def variance_with_bonus(self, location, bonuses: Items=None):
+        if bonuses is None:
+            bonuses = Items()
+        row = self.variance_matrix(self.bonus_vectors(bonuses), [location])[0]
+        return self._row_items(location, row)
+
+    def variance_with_party(self, location, party: PartySetup):
+        return self.variance_with_bonus(location, party.total_bonus())
+
     def stacks(self, location):
-        ret = {}
-        for item, item_data in self._data[location].items():
-            ret[item] = item_data['stacks']
-        return Items(ret)
+        return self._row_items(location, 
+            self._stacks[self._location_positions[location]])
+
+    def best_party(self, location, available: PartySetup=None, priorities=None,
+            exact=False, weights: Items=None):
+        if exact:
+            return self._best_party_exact(location, available, weights)
 
-    def best_party(self, location, available: PartySetup=None, priorities=None):
         supports = available['support']
         servants = available['servants']
         craft_essences = available['craft_essences']
@@ -134,24 +390,99 @@ class DropsData:
             support=out[2][:1]
         )
 
-    def best_drops(self, location, available_parties):
+    def _best_party_exact(self, location, available: PartySetup, 
+            weights: Items=None):
+        """Picks the party with the highest total value of drops, where 
+        weights gives the value of one of each material (default 1).
+
+        A party's drops are initial + (sum of bonuses) * stacks, so its value 
+        is a sum of independent per-member values and the optimal party 
+        under the 5/5/1 slot limits is the top members of each slot type."""
+        i = self._location_positions[location]
+        if weights is None:
+            weights = Items((item, 1) for item in self._columns[i])
+        value_per_bonus = self.bonus_vectors(weights) * self._stacks[i]
+
+        out = []
+        for domain, limit in ((available.servants, 5),
+                (available.craft_essences, 5), (available.support, 1)):
+            if not domain:
+                out.append([])
+                continue
+            scores = self.bonus_vectors(domain) @ value_per_bonus
+            order = np.argsort(-scores, kind='stable')[:limit]
+            out.append([domain[j] for j in order if scores[j] > 0])
+
+        return PartySetup(
+            servants=out[0],
+            craft_essences=out[1],
+            support=out[2]
+        )
+
+    def best_drops(self, location, available_parties, exact=False, 
+            weights: Items=None):
         return self.drops_with_party(location, self.best_party(
-            location, available_parties
+            location, available_parties, exact=exact, weights=weights
         ))
 
-    def optimise_drops(self, location_list, available_parties):
+    def optimise_drops(self, location_list, available_parties, exact=False,
+            weights: Items=None):
+        bonuses = self.bonus_vectors([
+            self.best_party(loc, available_parties, exact=exact, 
+                weights=weights).total_bonus()
+            for loc in location_list])
+        drops = self.drops_matrix(bonuses, location_list)
+
         drops_per_run = OrderedDict()
-        for loc in location_list:
-            drops_per_run[loc] = self.best_drops(loc, available_parties)
+        for loc, row in zip(location_list, drops):
+            drops_per_run[loc] = self._row_items(loc, row)
         return drops_per_run
 
 
+CacheInfo = namedtuple('CacheInfo', ('hits', 'misses', 'maxsize', 'currsize'))
+
+_SolverModel = namedtuple('_SolverModel', 
+    ('solver', 'node_vars', 'weights', 'ap_constraint', 'constraints'))
+
+# AP cost of a run at nodes without their own cost.
+DEFAULT_AP = 40
+
+def _ap_costs(nodes, ap_costs=None):
+    """Returns the AP cost of a run at each of the nodes, given either one 
+    cost for every node or a dict of costs by location.
+
+    Costs must be whole and positive, since plans are searched in steps of 
+    their greatest common divisor and a free node makes any plan possible."""
+    if ap_costs is None:
+        ap_costs = DEFAULT_AP
+    if not isinstance(ap_costs, dict):
+        ap_costs = {loc: ap_costs for loc in nodes}
+    costs = OrderedDict()
+    for loc in nodes:
+        cost = ap_costs.get(loc, DEFAULT_AP)
+        if cost <= 0 or cost != int(cost):
+            raise ValueError(
+                'AP cost of {} must be a positive integer, not {}'.format(
+                    loc, cost))
+        costs[loc] = int(cost)
+    return costs
+
 class EventOptimiser:
-    def __init__(self):
+    def __init__(self, single_solve=True, cache_size=1024):
+        self._single_solve = single_solve
         self._remaining = Items()
         self._target = Items()
         self._current = Items()
         self._farming_nodes = OrderedDict()
+        self._ap_costs = OrderedDict()
+        self._variances = OrderedDict()
+        self._nodes_key = ()
+        self._models = {}
+        self._plan = None
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_hits = 0
+        self._cache_misses = 0
 
     def _update_remaining(self):
         self._remaining.clear()
@@ -166,8 +497,32 @@ class EventOptimiser:
         self._current = items
         self._update_remaining()
 
-    def set_farming_nodes(self, nodes):
+    def set_farming_nodes(self, nodes, ap_costs=None, variances=None):
+        """Sets the drops per run of each farming node, and the AP a run 
+        costs as one number for every node or a dict by location. Nodes 
+        without a cost cost DEFAULT_AP.
+
+        variances optionally gives the variance of each node's drops per 
+        run by location, as from DropsData.variance_with_party(), for 
+        planning with a confidence."""
         self._farming_nodes = nodes
+        self._ap_costs = _ap_costs(nodes, ap_costs)
+        self._variances = OrderedDict(variances or ())
+        self._plan = None
+        self._nodes_key = tuple(
+            (loc, self._ap_costs[loc], tuple(sorted(drops.items())))
+            for loc, drops in nodes.items())
+        self._models.clear()
+
+    def cache_info(self):
+        """Returns hit and miss counts of the run requirement cache, in the 
+        style of functools.lru_cache."""
+        return CacheInfo(self._cache_hits, self._cache_misses, 
+            self._cache_size, len(self._cache))
+
+    def cache_clear(self):
+        self._cache.clear()
+        self._cache_hits = self._cache_misses = 0
 
     def _to_dict(self, array):
         assert len(array) == len(self._farming_nodes)
@@ -176,51 +531,217 @@ class EventOptimiser:
             d[key] = array[i]
         return d
 
+    def _build_model(self, use_int):
+        if use_int:
+            solver = pywraplp.Solver('IntegerSolver', 
+                pywraplp.Solver.CBC_MIXED_INTEGER_PROGRAMMING) 
+        else:
+            solver = pywraplp.Solver('LinearSolver',
+                pywraplp.Solver.GLOP_LINEAR_PROGRAMMING)
+
+        make_var = solver.IntVar if use_int else solver.NumVar
+
+        ap_constraint = solver.Constraint(0, solver.infinity())
+
+        node_vars = []
+        weights = []
+        constraints = {}
+        for i, (loc, drops) in enumerate(self._farming_nodes.items()):
+            sq_sum = 0
+            this_var = make_var(0, solver.infinity(), loc)
+            node_vars.append(this_var)
+            for material, number in drops.items():
+                if material not in constraints:
+                    constraints[material] = solver.Constraint(
+                        0, solver.infinity())
+                    
+                constraints[material].SetCoefficient(this_var, number)
+                sq_sum += number**2
+            weights.append(math.sqrt(sq_sum))
+            ap_constraint.SetCoefficient(this_var, self._ap_costs[loc])
+
+        return _SolverModel(solver, node_vars, weights, ap_constraint, 
+            constraints)
+
+    def _model(self, use_int):
+        """Returns the solver model for the current farming nodes, with 
+        material bounds updated to the current remaining items.
+
+        The model is built once per set_farming_nodes() call and reused by 
+        later solves, which only reset its bounds."""
+        model = self._models.get(use_int)
+        if model is None:
+            model = self._models[use_int] = self._build_model(use_int)
+
+        for material, constraint in model.constraints.items():
+            constraint.SetBounds(self._remaining[material], 
+                model.solver.infinity())
+        model.ap_constraint.SetBounds(0, model.solver.infinity())
+        return model
+
+    @staticmethod
+    def _solve(solver):
+        status = solver.Solve()
+        if status == pywraplp.Solver.OPTIMAL:
+            assert solver.VerifySolution(1e-7, True)
+            return True
+        elif status == pywraplp.Solver.INFEASIBLE:
+            return False
+        else:
+            raise Exception('Unexpected error.')
+
     def _do_optimise(self, use_int=True):
-        for n in count():
-            if use_int:
-                solver = pywraplp.Solver('IntegerSolver', 
-                    pywraplp.Solver.CBC_MIXED_INTEGER_PROGRAMMING) 
-            else:
-                solver = pywraplp.Solver('LinearSolver',
-                    pywraplp.Solver.GLOP_LINEAR_PROGRAMMING)
-
-            make_var = solver.IntVar if use_int else solver.NumVar
-
-            num_constraint = solver.Constraint(n, n)
-
-            objective = solver.Objective()
-            node_vars = []
-            constraints = {}
-            for i, (loc, drops) in enumerate(self._farming_nodes.items()):
-                sq_sum = 0
-                this_var = make_var(0, solver.infinity(), loc)
-                node_vars.append(this_var)
-                for material, number in drops.items():
-                    if material not in constraints:
-                        constraints[material] = solver.Constraint(
-                            self._remaining[material], solver.infinity())
-                        
-                    constraints[material].SetCoefficient(this_var, number)
-                    sq_sum += number**2
-                objective.SetCoefficient(this_var, math.sqrt(sq_sum))
-                num_constraint.SetCoefficient(this_var, 1)
-
-
-            objective.SetMaximization()
-
-            status = solver.Solve()
-            if status == pywraplp.Solver.OPTIMAL:
-                assert solver.VerifySolution(1e-7, True)
-                return [var.solution_value() for var in node_vars]
-            elif status == pywraplp.Solver.INFEASIBLE:
-                continue
-            else:
-                raise Exception('Unexpected error.')
+        key = (self._nodes_key, use_int, tuple(sorted(
+            (mat, num) for mat, num in self._remaining.items() if num)))
+        if key in self._cache:
+            self._cache_hits += 1
+            self._cache.move_to_end(key)
+            return list(self._cache[key])
+        self._cache_misses += 1
+
+        if self._single_solve:
+            result = self._do_optimise_two_phase(use_int)
+        else:
+            result = self._do_optimise_probing(use_int)
 
-    def optimise_runs(self):
-        result = self._do_optimise()
-        return self._to_dict(result)
+        if self._cache_size:
+            self._cache[key] = tuple(result)
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _do_optimise_probing(self, use_int=True):
+        model = self._model(use_int)
+
+        objective = model.solver.Objective()
+        for var, weight in zip(model.node_vars, model.weights):
+            objective.SetCoefficient(var, weight)
+        objective.SetMaximization()
+
+        for n in count(0, self._ap_step()):
+            model.ap_constraint.SetBounds(n, n)
+            if self._solve(model.solver):
+                return [var.solution_value() for var in model.node_vars]
+
+    def _do_optimise_two_phase(self, use_int=True):
+        model = self._model(use_int)
+
+        # phase 1: least total AP.
+        objective = model.solver.Objective()
+        for var, loc in zip(model.node_vars, self._farming_nodes):
+            objective.SetCoefficient(var, self._ap_costs[loc])
+        objective.SetMinimization()
+        if not self._solve(model.solver):
+            raise Exception('Target cannot be reached with these nodes.')
+
+        # the probing loop only tries multiples of the AP step, so round up 
+        # the linear relaxation's optimum to match it.
+        step = self._ap_step()
+        n = math.ceil((objective.Value() - 1e-7) / step) * step
+
+        # phase 2: among plans costing exactly n AP, maximise the drops.
+        model.ap_constraint.SetBounds(n, n)
+        for var, weight in zip(model.node_vars, model.weights):
+            objective.SetCoefficient(var, weight)
+        objective.SetMaximization()
+        if not self._solve(model.solver):
+            raise Exception('Unexpected error.')
+        return [var.solution_value() for var in model.node_vars]
+
+    def _ap_step(self):
+        """Greatest common divisor of the nodes' AP costs, which every 
+        plan's total AP is a multiple of."""
+        return functools.reduce(math.gcd, self._ap_costs.values(), 0) or 1
+
+    def optimise_runs(self, confidence=None, scenarios=10000, seed=0):
+        """Returns the runs of each node in the cheapest plan which reaches 
+        the target.
+
+        Given a confidence, drops are treated as random with the node 
+        variances, and the plan returned is the cheapest found which reaches 
+        the whole target in at least that fraction of simulated scenarios. 
+        It is found by raising the target of materials which fall short and 
+        solving again."""
+        if confidence is None:
+            self._plan = self._to_dict(self._do_optimise())
+        else:
+            self._plan = self._optimise_with_confidence(
+                confidence, scenarios, seed)
+        return self._plan
+
+    def record_run(self, node, observed_drops: Items=None, confidence=None):
+        """Adds the drops of one completed run of node to the current items 
+        and returns the plan for the rest of the target.
+
+        observed_drops defaults to the node's expected drops. The new plan 
+        keeps the current farming nodes, so PartyEventOptimiser keeps its 
+        parties; call optimise_runs() to choose them again. It reuses the 
+        persistent solver model, so only its bounds change."""
+        if observed_drops is None:
+            observed_drops = self._farming_nodes[node]
+        current = Items(self._current)
+        for mat, num in observed_drops.items():
+            current[mat] += num
+        self.set_current(current)
+        return EventOptimiser.optimise_runs(self, confidence=confidence)
+
+    def _optimise_with_confidence(self, confidence, scenarios, seed, 
+            max_iterations=50):
+        remaining = self._remaining
+        needed = [mat for mat, num in remaining.items() if num > 0]
+        margins = Items()
+        # the quantile each material must reach, raised when every material 
+        # does but the target as a whole still falls short too often.
+        level = confidence
+        try:
+            for i in range(max_iterations):
+                self._remaining = Items((mat, num + margins[mat]) 
+                    for mat, num in remaining.items())
+                runs = self._to_dict(self._do_optimise())
+
+                self._remaining = remaining
+                totals = self._simulate(runs, needed, scenarios, seed)
+                targets = np.array([remaining[mat] for mat in needed])
+                if np.all(totals >= targets, axis=1).mean() >= confidence:
+                    return runs
+
+                shortfall = targets - np.quantile(totals, 1 - level, axis=0)
+                if not np.any(shortfall > 0):
+                    level = 1 - (1 - level) / 2
+                for mat, short in zip(needed, shortfall):
+                    if short > 0:
+                        margins[mat] += short.item()
+        finally:
+            self._remaining = remaining
+        raise Exception('Confidence could not be reached.')
+
+    def _simulate(self, runs, needed, scenarios, seed):
+        """Samples total drops of the needed materials from the runs, with 
+        one row per scenario, using a normal approximation of the sum of 
+        each node's drops."""
+        locations = [loc for loc, times in runs.items() if times]
+        times = np.array([runs[loc] for loc in locations], dtype=float)
+        mean = np.array([[self._farming_nodes[loc].get(mat, 0) for mat in needed] 
+            for loc in locations]).reshape(len(locations), len(needed))
+        variance = np.array(
+            [[self._variances.get(loc, {}).get(mat, 0) for mat in needed] 
+            for loc in locations]).reshape(len(locations), len(needed))
+
+        random = np.random.RandomState(seed)
+        noise = random.standard_normal((scenarios, len(needed)))
+        return times @ mean + noise * np.sqrt(times @ variance)
+
+    def success_probability(self, runs, scenarios=10000, seed=None):
+        """Returns the fraction of simulated scenarios in which the runs 
+        reach the whole target."""
+        needed = [mat for mat, num in self._remaining.items() if num > 0]
+        totals = self._simulate(runs, needed, scenarios, seed)
+        targets = np.array([self._remaining[mat] for mat in needed])
+        return np.all(totals >= targets, axis=1).mean().item()
+
+    def total_ap(self, nodes_farmed):
+        return sum(self._ap_costs[loc] * times 
+            for loc, times in nodes_farmed.items())
 
     def total_items(self, nodes_farmed):
         total = Items()
@@ -230,12 +751,175 @@ class EventOptimiser:
         return total
 
 
+class PartyEventOptimiser(EventOptimiser):
+    """Chooses the party for each farming location together with the number 
+    of runs, so that parties are picked for the materials still needed.
+
+    Use set_locations() instead of set_farming_nodes(). Nodes with a fixed 
+    party can be given as drops per run in fixed_nodes, with their drop 
+    variances in fixed_variances, and AP costs as in set_farming_nodes(). 
+    The variances of the other nodes come from the drop data for the chosen 
+    parties. After optimise_runs(), the chosen parties are in self.parties 
+    and the resulting drops per run in self._farming_nodes."""
+
+    _SLOT_LIMITS = (('servants', 5), ('craft_essences', 5), ('support', 1))
+
+    def __init__(self, data: DropsData, available: PartySetup, **kwargs):
+        super().__init__(**kwargs)
+        self._data = data
+        self._available = available
+        self._locations = []
+        self._fixed_nodes = OrderedDict()
+        self._location_ap_costs = None
+        self._fixed_variances = {}
+        self.parties = OrderedDict()
+
+    def set_locations(self, locations, fixed_nodes=None, ap_costs=None, 
+            fixed_variances=None):
+        self._locations = list(locations)
+        self._fixed_nodes = OrderedDict(fixed_nodes or ())
+        self._location_ap_costs = ap_costs
+        self._fixed_variances = dict(fixed_variances or ())
+
+    def _set_parties(self, parties, nodes):
+        variances = OrderedDict(
+            (loc, self._data.variance_with_party(loc, party))
+            for loc, party in parties.items())
+        variances.update(self._fixed_variances)
+        EventOptimiser.set_farming_nodes(self, nodes, self._location_ap_costs, 
+            variances)
+
+    def _two_stage(self):
+        """Picks parties by priority and then runs, as the farming scripts 
+        do. Returns the parties and their drops."""
+        parties = OrderedDict()
+        nodes = OrderedDict()
+        for loc in self._locations:
+            parties[loc] = self._data.best_party(loc, self._available)
+            nodes[loc] = self._data.drops_with_party(loc, parties[loc])
+        nodes.update(self._fixed_nodes)
+        return parties, nodes
+
+    def _grouped_members(self):
+        """Groups identical party members so that copies can be ordered, 
+        which stops the solver trying every permutation of them."""
+        groups = []
+        for slot, limit in self._SLOT_LIMITS:
+            members = OrderedDict()
+            for member in self._available[slot]:
+                key = tuple(sorted((m, n) for m, n in member.items() if n))
+                if key:
+                    members.setdefault(key, []).append(member)
+            groups.append((slot, limit, list(members.values())))
+        return groups
+
+    def _solve_parties(self, max_runs, hint_parties, hint_runs):
+        # SCIP, as CBC ignores the solution hint.
+        solver = pywraplp.Solver('SolvePartiesProblem', 
+            pywraplp.Solver.SCIP_MIXED_INTEGER_PROGRAMMING)
+        objective = solver.Objective()
+        constraints = {}
+
+        def material_constraint(material):
+            if material not in constraints:
+                constraints[material] = solver.Constraint(
+                    self._remaining[material], solver.infinity())
+            return constraints[material]
+
+        run_vars = OrderedDict()
+        for loc, drops in self._fixed_nodes.items():
+            var = run_vars[loc] = solver.IntVar(0, max_runs, loc)
+            for mat, num in drops.items():
+                material_constraint(mat).SetCoefficient(var, num)
+
+        hint_vars, hint_values = [], []
+        member_vars = OrderedDict()
+        groups = self._grouped_members()
+        for loc in self._locations:
+            var = run_vars[loc] = solver.IntVar(0, max_runs, loc)
+            hint_vars.append(var)
+            hint_values.append(hint_runs[loc])
+            for mat, num in self._data.drops_with_bonus(loc).items():
+                material_constraint(mat).SetCoefficient(var, num)
+            stacks = self._data.stacks(loc)
+
+            member_vars[loc] = []
+            for slot, limit, slot_groups in groups:
+                slot_constraint = solver.Constraint(0, limit)
+                for members in slot_groups:
+                    in_hint = hint_parties[loc][slot].count(members[0])
+                    previous = None
+                    for k, member in enumerate(members[:limit]):
+                        # chosen: is this copy in the party.
+                        # used: runs at this node with this copy, which is 
+                        # runs if chosen and 0 otherwise.
+                        chosen = solver.IntVar(0, 1, '')
+                        used = solver.NumVar(0, solver.infinity(), '')
+                        slot_constraint.SetCoefficient(chosen, 1)
+
+                        upper = solver.Constraint(-solver.infinity(), 0)
+                        upper.SetCoefficient(used, 1)
+                        upper.SetCoefficient(var, -1)
+                        upper = solver.Constraint(-solver.infinity(), 0)
+                        upper.SetCoefficient(used, 1)
+                        upper.SetCoefficient(chosen, -max_runs)
+                        if previous is not None:
+                            order = solver.Constraint(0, solver.infinity())
+                            order.SetCoefficient(previous, 1)
+                            order.SetCoefficient(chosen, -1)
+                        previous = chosen
+
+                        for mat, num in member.items():
+                            if stacks[mat]:
+                                material_constraint(mat).SetCoefficient(
+                                    used, num * stacks[mat])
+                        member_vars[loc].append((slot, member, chosen))
+                        hint_vars.append(chosen)
+                        hint_values.append(int(k < in_hint))
+
+        for loc, var in run_vars.items():
+            objective.SetCoefficient(var, self._ap_costs[loc])
+        objective.SetMinimization()
+        solver.SetHint(hint_vars, hint_values)
+
+        if self._solve(solver):
+            parties = OrderedDict()
+            for loc in self._locations:
+                chosen = {slot: [] for slot, limit in self._SLOT_LIMITS}
+                for slot, member, var in member_vars[loc]:
+                    if var.solution_value() > 0.5:
+                        chosen[slot].append(member)
+                parties[loc] = PartySetup(**chosen)
+            return parties
+        raise Exception('Unexpected error.')
+
+    def optimise_runs(self, **kwargs):
+        parties, nodes = self._two_stage()
+        self._set_parties(parties, nodes)
+        runs = super().optimise_runs()
+
+        # the two stage plan is feasible for the joint model, so its AP 
+        # bounds the runs at any one node.
+        parties = self._solve_parties(
+            math.ceil(self.total_ap(runs) / min(self._ap_costs.values())), 
+            parties, runs)
+
+        nodes = OrderedDict()
+        for loc, party in parties.items():
+            nodes[loc] = self._data.drops_with_party(loc, party)
+        nodes.update(self._fixed_nodes)
+        self.parties = parties
+        self._set_parties(parties, nodes)
+        return super().optimise_runs(**kwargs)
+
+
 class SummerProjectsOptimiser:
     def __init__(self, chunked=False):
         self._chunked = chunked
         self._available = PartySetup()
         self._all_projects = []
         self._all_farming_nodes = []
+        self._all_ap_costs = []
 
     def set_projects(self, projects: OrderedDict):
         if self._chunked:
@@ -243,11 +927,18 @@ class SummerProjectsOptimiser:
         else:
             self._all_projects = [projects]
 
-    def set_farming_nodes(self, nodes):
+    def set_farming_nodes(self, nodes, ap_costs=None):
+        """Sets the farming nodes, and their AP costs as accepted by 
+        EventOptimiser.set_farming_nodes(). When chunked, ap_costs may also 
+        be a list with the costs of each chunk's nodes."""
         if self._chunked:
             self._all_farming_nodes = nodes
+            if not isinstance(ap_costs, (list, tuple)):
+                ap_costs = [ap_costs] * len(nodes)
+            self._all_ap_costs = list(ap_costs)
         else:
             self._all_farming_nodes = [nodes]
+            self._all_ap_costs = [ap_costs]
 
     def optimise_projects(self):
         self._event_opt = EventOptimiser()
@@ -255,7 +946,8 @@ class SummerProjectsOptimiser:
         for i, chunk in enumerate(self._all_projects):
             result.append(self._optimise_one_chunk(
                 chunk,
-                self._all_farming_nodes[i]
+                self._all_farming_nodes[i],
+                self._all_ap_costs[i]
             ))
         return result if self._chunked else result[0]
 
@@ -268,9 +960,9 @@ class SummerProjectsOptimiser:
                 weights[drop] += num
         return weights
 
-    def _optimise_one_chunk(self, chunk, nodes):
+    def _optimise_one_chunk(self, chunk, nodes, ap_costs=None):
         event_opt = self._event_opt
-        event_opt.set_farming_nodes(nodes)
+        event_opt.set_farming_nodes(nodes, ap_costs)
 
         temp_current = event_opt._current
         event_opt.set_current(Items())
@@ -292,13 +984,11 @@ class SummerProjectsOptimiser:
                 event_opt.set_target(project['cost'])
                 runs_required = event_opt._do_optimise(use_int=True)
 
-                coeff = sum(runs_required)
+                coeff = event_opt.total_ap(event_opt._to_dict(runs_required))
                 objective.SetCoefficient(var, coeff)
 
                 project_list.append([project, var])
 
-        existing_mats = solver.IntVar(1, 1)
-
         objective.SetMinimization()
         assert solver.Solve() == solver.OPTIMAL
 
@@ -321,5 +1011,5 @@ class SummerProjectsOptimiser:
             'required_materials': required,
             'runs': runs,
             'total_runs': sum(runs.values()),
-            'ap': 40*sum(runs.values()),
+            'ap': event_opt.total_ap(runs),
         }
@@ -1,15 +1,86 @@
 from fgo_tools import *
+from fgo_tools import _ap_costs
 
 import platypus
+from platypus.evaluator import run_job
+from ortools.linear_solver import pywraplp
 
 from collections import defaultdict, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import math
+
+_worker_event_opt = None
+
+def _init_worker(nodes, ap_costs, current):
+    global _worker_event_opt
+    _worker_event_opt = EventOptimiser()
+    _worker_event_opt.set_farming_nodes(nodes, ap_costs)
+    _worker_event_opt.set_current(current)
+
+
+class _ChunkFitness:
+    """Fitness function for one chunk's project selection.
+
+    When pickled into a worker process, the event optimiser is left behind 
+    and the worker's own preloaded optimiser is used instead."""
+
+    def __init__(self, chunk, event_opt=None):
+        self._group_sizes = [len(group) for group in chunk]
+        self._costs = ItemsArray.stack(
+            [proj['cost'] for group in chunk for proj in group])
+        self._event_opt = event_opt
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_event_opt'] = None
+        return state
+
+    def _constrain_projects(self, input_vars):
+        output = []
+        start = 0
+        for size in self._group_sizes:
+            end = start + size
+            output.append(sum(input_vars[start:end]))
+            start = end
+        return output
+
+    def __call__(self, input_vars):
+        constraints = self._constrain_projects(input_vars)
+        if any(x != 1 for x in constraints):
+            return (0, constraints)
+        
+        required = self._costs.weighted_sum(input_vars).to_items()
+
+        event_opt = self._event_opt
+        if event_opt is None:
+            event_opt = _worker_event_opt
+        event_opt.set_target(required)
+        return (event_opt.total_ap(event_opt.optimise_runs()), 
+            constraints)
+
+
+class _BatchEvaluator(platypus.Evaluator):
+    """Evaluates each generation across a process pool, handing every 
+    worker one contiguous batch of the population."""
+
+    def __init__(self, executor, workers):
+        super().__init__()
+        self._executor = executor
+        self._workers = workers
+
+    def evaluate_all(self, jobs, **kwargs):
+        chunksize = max(1, math.ceil(len(jobs) / self._workers))
+        return list(self._executor.map(run_job, jobs, chunksize=chunksize))
+
 
 class SummerProjectsOptimiser2:
-    def __init__(self, chunked=False):
+    def __init__(self, chunked=False, workers=1):
         self._chunked = chunked
+        self._workers = workers
         self._available = PartySetup()
         self._all_projects = []
         self._all_farming_nodes = []
+        self._all_ap_costs = []
 
     def set_projects(self, projects: OrderedDict):
         if self._chunked:
@@ -17,13 +88,26 @@ class SummerProjectsOptimiser2:
         else:
             self._all_projects = [projects]
 
-    def set_farming_nodes(self, nodes):
+    def set_farming_nodes(self, nodes, ap_costs=None):
+        """Sets the farming nodes, and their AP costs as accepted by 
+        EventOptimiser.set_farming_nodes(). When chunked, ap_costs may also 
+        be a list with the costs of each chunk's nodes."""
         if self._chunked:
             self._all_farming_nodes = nodes
+            if not isinstance(ap_costs, (list, tuple)):
+                ap_costs = [ap_costs] * len(nodes)
+            self._all_ap_costs = list(ap_costs)
         else:
             self._all_farming_nodes = [nodes]
+            self._all_ap_costs = [ap_costs]
 
     def optimise_projects(self, initial_materials=None, iterations=100):
+        self._iterations = iterations
+        return self._each_chunk(initial_materials, self._optimise_one_chunk)
+
+    def _each_chunk(self, initial_materials, optimise_chunk):
+        """Calls optimise_chunk(chunk, nodes, ap_costs) for each chunk in 
+        turn, sharing one EventOptimiser whose current items carry over."""
         self._event_opt = EventOptimiser()
         if initial_materials is not None:
             self._event_opt.set_current(initial_materials)
@@ -31,46 +115,36 @@ class SummerProjectsOptimiser2:
         for i, chunk in enumerate(self._all_projects):
             self._current_chunk = chunk
             self._chunk_projects = [proj for group in chunk for proj in group]
-            result.append(self._optimise_one_chunk(
+            self._chunk_costs = ItemsArray.stack(
+                [proj['cost'] for proj in self._chunk_projects])
+            result.append(optimise_chunk(
                 chunk,
                 self._all_farming_nodes[i],
-                iterations
+                self._all_ap_costs[i]
             ))
         return result if self._chunked else result[0]
 
-    def _constrain_projects(self, input_vars):
-        output = []
-        start = 0
-        for group in self._current_chunk:
-            end = start + len(group)
-            output.append(sum(input_vars[start:end]))
-            start = end
-        return output
+    def _calculate_required(self, variables):
+        return self._chunk_costs.weighted_sum(
+            [int(x[0]) for x in variables]).to_items()
 
-    def _problem_function(self, input_vars):
-        constraints = self._constrain_projects(input_vars)
-        if any(x != 1 for x in constraints):
-            return (0, constraints)
-        
-        required = Items()
-        for i, p in enumerate(input_vars):
-            if p:
-                required += Items(self._chunk_projects[i]['cost'])
-        self._event_opt.set_target(required)
+    def _run_algorithm(self, problem, nodes, ap_costs, iterations):
+        if self._workers <= 1:
+            algorithm = platypus.NSGAII(problem)
+            algorithm.run(iterations)
+            return algorithm
 
-        return (sum(self._event_opt.optimise_runs().values()), 
-            constraints)
+        with ProcessPoolExecutor(self._workers, initializer=_init_worker,
+                initargs=(nodes, ap_costs, self._event_opt._current)) \
+                as executor:
+            algorithm = platypus.NSGAII(problem, 
+                evaluator=_BatchEvaluator(executor, self._workers))
+            algorithm.run(iterations)
+        return algorithm
 
-    def _calculate_required(self, variables):
-        required = Items()
-        for i, x in enumerate(variables):
-            if x[0]:
-                required += self._chunk_projects[i]['cost']
-        return required
-
-    def _optimise_one_chunk(self, chunk, nodes, iterations=100):
+    def _optimise_one_chunk(self, chunk, nodes, ap_costs=None):
         event_opt = self._event_opt
-        event_opt.set_farming_nodes(nodes)
+        event_opt.set_farming_nodes(nodes, ap_costs)
 
         n_variables = sum(len(x) for x in chunk)
         n_constraints = len(chunk)
@@ -78,11 +152,11 @@ class SummerProjectsOptimiser2:
         problem = platypus.Problem(n_variables, 1, n_constraints)
         problem.types[:] = platypus.Integer(0, 1)
         problem.constraints[:] = '==1'
-        problem.function = self._problem_function
+        problem.function = _ChunkFitness(chunk, event_opt)
         problem.directions[:] = platypus.Problem.MINIMIZE
 
-        algorithm = platypus.NSGAII(problem)
-        algorithm.run(iterations)
+        algorithm = self._run_algorithm(problem, nodes, ap_costs, 
+            self._iterations)
 
         possible_results = [s for s in algorithm.result if s.feasible]
         possible_results.sort(key=lambda x: self._calculate_required(x.variables).magnitude(), reverse=True)
@@ -105,5 +179,275 @@ class SummerProjectsOptimiser2:
             'required_materials': required,
             'runs': runs,
             'total_runs': sum(runs.values()),
-            'ap': 40*sum(runs.values()),
+            'ap': event_opt.total_ap(runs),
         }
+
+
+class SummerProjectsOptimiser3(SummerProjectsOptimiser2):
+    """Chooses one project per group and the node runs for a chunk in a 
+    single integer program, rather than searching selections with NSGA-II.
+
+    pareto_projects() instead gives, for each chunk, every plan on the 
+    trade-off between AP spent and surplus materials left over."""
+
+    def optimise_projects(self, initial_materials=None):
+        return self._each_chunk(initial_materials, self._optimise_one_chunk)
+
+    def _chunk_model(self, chunk, nodes):
+        """Builds the integer program for a chunk, with one constraint per 
+        material that the current items plus drops cover the projects."""
+        current = self._event_opt._current
+        solver = pywraplp.Solver('SolveIntegerProblem', 
+            pywraplp.Solver.CBC_MIXED_INTEGER_PROGRAMMING)
+        constraints = OrderedDict()
+
+        def material_constraint(material):
+            if material not in constraints:
+                constraints[material] = solver.Constraint(
+                    -current[material], solver.infinity())
+            return constraints[material]
+
+        project_vars = []
+        for project_group in chunk:
+            group_constraint = solver.Constraint(1, 1)
+            for project in project_group:
+                var = solver.IntVar(0, 1, project['name'])
+                group_constraint.SetCoefficient(var, 1)
+                for mat, num in project['cost'].items():
+                    material_constraint(mat).SetCoefficient(var, -num)
+                project_vars.append(var)
+
+        node_vars = OrderedDict()
+        for loc, drops in nodes.items():
+            var = node_vars[loc] = solver.IntVar(0, solver.infinity(), loc)
+            for mat, num in drops.items():
+                material_constraint(mat).SetCoefficient(var, num)
+
+        return solver, project_vars, node_vars, constraints
+
+    def _optimise_one_chunk(self, chunk, nodes, ap_costs=None):
+        event_opt = self._event_opt
+        event_opt.set_farming_nodes(nodes, ap_costs)
+
+        solver, project_vars, node_vars, constraints = \
+            self._chunk_model(chunk, nodes)
+        objective = solver.Objective()
+        for loc, var in node_vars.items():
+            objective.SetCoefficient(var, event_opt._ap_costs[loc])
+
+        objective.SetMinimization()
+        if solver.Solve() != solver.OPTIMAL:
+            print('No feasible solutions.')
+            return
+
+        selected = [[var.solution_value() > 0.5] for var in project_vars]
+        required = self._calculate_required(selected)
+        event_opt.set_target(required)
+        runs = event_opt.optimise_runs()
+
+        current_items = event_opt.total_items(runs) + event_opt._current
+        event_opt.set_current(current_items-required)
+
+        return {
+            'projects': [self._chunk_projects[i]['name'] 
+                for i, s in enumerate(selected) if s[0]],
+            'required_materials': required,
+            'runs': runs,
+            'total_runs': sum(runs.values()),
+            'ap': event_opt.total_ap(runs),
+        }
+
+    def pareto_projects(self, initial_materials=None, max_extra_ap=400, 
+            caps=None):
+        """Returns the non-dominated plans of each chunk, trading AP spent 
+        against the total surplus left afterwards, summed over the chunk's 
+        materials and reported as 'total_surplus'.
+
+        Plans costing up to max_extra_ap more than the cheapest are swept 
+        with an epsilon constraint on AP, maximising the total surplus 
+        within each budget on the same solver model. caps optionally limits 
+        how much surplus of each material is useful. The cheapest plan's 
+        leftover items are carried into the next chunk."""
+        return self._each_chunk(initial_materials, 
+            lambda chunk, nodes, ap_costs: self._pareto_one_chunk(
+                chunk, nodes, ap_costs, max_extra_ap, caps or {}))
+
+    def _pareto_one_chunk(self, chunk, nodes, ap_costs, max_extra_ap, caps):
+        event_opt = self._event_opt
+        event_opt.set_farming_nodes(nodes, ap_costs)
+
+        solver, project_vars, node_vars, constraints = \
+            self._chunk_model(chunk, nodes)
+
+        # surplus of each material, up to its cap, which is the slack of 
+        # that material's constraint.
+        surplus_constraint = solver.Constraint(0, solver.infinity())
+        surplus_vars = []
+        for mat, constraint in constraints.items():
+            var = solver.NumVar(0, caps.get(mat, solver.infinity()), mat)
+            constraint.SetCoefficient(var, -1)
+            surplus_constraint.SetCoefficient(var, 1)
+            surplus_vars.append(var)
+
+        ap_constraint = solver.Constraint(0, solver.infinity())
+        for loc, var in node_vars.items():
+            ap_constraint.SetCoefficient(var, event_opt._ap_costs[loc])
+
+        def minimise_ap():
+            objective = solver.Objective()
+            objective.Clear()
+            for loc, var in node_vars.items():
+                objective.SetCoefficient(var, event_opt._ap_costs[loc])
+            objective.SetMinimization()
+            return solver.Solve() == solver.OPTIMAL
+
+        if not minimise_ap():
+            print('No feasible solutions.')
+            return
+
+        min_ap = solver.Objective().Value()
+        step = event_opt._ap_step()
+        budget = min_ap
+        plans = []
+        while budget <= min_ap + max_extra_ap + 1e-7:
+            # most surplus within the budget, then the least AP for it.
+            ap_constraint.SetBounds(0, budget)
+            objective = solver.Objective()
+            objective.Clear()
+            for var in surplus_vars:
+                objective.SetCoefficient(var, 1)
+            objective.SetMaximization()
+            if solver.Solve() != solver.OPTIMAL:
+                raise Exception('Unexpected error.')
+            surplus_constraint.SetBounds(
+                objective.Value() - 1e-6, solver.infinity())
+            if not minimise_ap():
+                raise Exception('Unexpected error.')
+            plan = self._pareto_plan(
+                project_vars, node_vars, constraints, caps)
+            surplus_constraint.SetBounds(0, solver.infinity())
+            # a bigger budget may not buy more surplus, which gives the same 
+            # plan again.
+            if not plans or plan['ap'] != plans[-1]['ap']:
+                plans.append(plan)
+            budget = max(budget, plan['ap']) + step
+
+        front = []
+        for plan in sorted(plans, key=lambda x: x['ap']):
+            if not front or \
+                    plan['total_surplus'] > front[-1]['total_surplus'] + 1e-7:
+                front.append(plan)
+
+        event_opt.set_current(front[0]['remaining'])
+        return front
+
+    def _pareto_plan(self, project_vars, node_vars, materials, caps):
+        event_opt = self._event_opt
+        selected = [[var.solution_value() > 0.5] for var in project_vars]
+        required = self._calculate_required(selected)
+        runs = OrderedDict((loc, int(round(var.solution_value())))
+            for loc, var in node_vars.items())
+        remaining = event_opt.total_items(runs) + event_opt._current - required
+        surplus = Items((mat, min(remaining[mat], caps.get(mat, 
+            remaining[mat]))) for mat in materials if remaining[mat] > 0)
+        return {
+            'projects': [self._chunk_projects[i]['name'] 
+                for i, s in enumerate(selected) if s[0]],
+            'required_materials': required,
+            'runs': runs,
+            'total_runs': sum(runs.values()),
+            'ap': event_opt.total_ap(runs),
+            'remaining': remaining,
+            'surplus': surplus,
+            'total_surplus': sum(surplus.values()),
+        }
+
+
+class CampaignOptimiser(SummerProjectsOptimiser2):
+    """Plans every chunk of a campaign in one integer program, minimising 
+    the total AP spent over all of them.
+
+    Materials carry over between chunks, so a chunk may farm more than it 
+    needs when its nodes are the cheaper (or only) source of something a 
+    later chunk requires. Each chunk's projects must be paid for from the 
+    starting inventory plus everything farmed up to the end of that chunk."""
+
+    def __init__(self):
+        super().__init__(chunked=True)
+
+    def optimise_projects(self, initial_materials=None):
+        current = Items(initial_materials or {})
+
+        solver = pywraplp.Solver('SolveIntegerProblem', 
+            pywraplp.Solver.CBC_MIXED_INTEGER_PROGRAMMING)
+        objective = solver.Objective()
+
+        # each chunk's balance constraints include every earlier chunk's 
+        # projects and runs, so surplus is carried forwards.
+        balances = []
+        def add_coefficient(chunk_index, mat, var, num):
+            for constraints in balances[chunk_index:]:
+                if mat not in constraints:
+                    constraints[mat] = solver.Constraint(
+                        -current[mat], solver.infinity())
+                constraints[mat].SetCoefficient(var, num)
+
+        chunk_vars = []
+        all_ap_costs = [_ap_costs(nodes, ap_costs) for nodes, ap_costs 
+            in zip(self._all_farming_nodes, self._all_ap_costs)]
+        for i, (chunk, nodes) in enumerate(
+                zip(self._all_projects, self._all_farming_nodes)):
+            balances.append({})
+            project_vars = []
+            for project_group in chunk:
+                group_constraint = solver.Constraint(1, 1)
+                for project in project_group:
+                    var = solver.IntVar(0, 1, '{} {}'.format(i, project['name']))
+                    group_constraint.SetCoefficient(var, 1)
+                    project_vars.append((project, var))
+
+            node_vars = OrderedDict()
+            for loc in nodes:
+                var = solver.IntVar(0, solver.infinity(), '{} {}'.format(i, loc))
+                objective.SetCoefficient(var, all_ap_costs[i][loc])
+                node_vars[loc] = var
+            chunk_vars.append((project_vars, node_vars))
+
+        for i, (project_vars, node_vars) in enumerate(chunk_vars):
+            for project, var in project_vars:
+                for mat, num in project['cost'].items():
+                    add_coefficient(i, mat, var, -num)
+            for loc, var in node_vars.items():
+                for mat, num in self._all_farming_nodes[i][loc].items():
+                    add_coefficient(i, mat, var, num)
+
+        objective.SetMinimization()
+        if solver.Solve() != solver.OPTIMAL:
+            print('No feasible solutions.')
+            return
+
+        result = []
+        for i, (project_vars, node_vars) in enumerate(chunk_vars):
+            projects = [proj for proj, var in project_vars 
+                if var.solution_value() > 0.5]
+            required = Items()
+            for proj in projects:
+                for mat, num in proj['cost'].items():
+                    required[mat] += num
+            runs = OrderedDict((loc, int(round(var.solution_value())))
+                for loc, var in node_vars.items())
+            for loc, num in runs.items():
+                for mat, drops in self._all_farming_nodes[i][loc].items():
+                    current[mat] += num * drops
+            current = current - required
+
+            result.append({
+                'projects': [proj['name'] for proj in projects],
+                'required_materials': required,
+                'runs': runs,
+                'total_runs': sum(runs.values()),
+                'ap': sum(all_ap_costs[i][loc] * num 
+                    for loc, num in runs.items()),
+                'remaining': Items(current),
+            })
+        return result
@@ -1,8 +1,447 @@
 import cv2
 import numpy as np
 import pyautogui
+import glob
+import json
+import os
+import queue
 import random
+import threading
 import time
+from collections import deque
+
+
+'''
+
+Captures the screen continuously on a background thread, keeping the most 
+recent grayscale frames in a ring buffer of the given size.
+
+latest(after) returns the newest (timestamp, frame) pair, waiting only if no 
+frame has been captured since the time after. If a capture fails, the thread 
+keeps going and the error is raised from the next latest() call.
+
+'''
+class CaptureThread(threading.Thread):
+    def __init__(self, interval=0.05, size=8):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.buffer = deque(maxlen=size)
+        self.captures = 0
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._error = None
+
+    def run(self):
+        while not self._stopped.is_set():
+            start = time.time()
+            try:
+                frame = cv2.cvtColor(np.array(pyautogui.screenshot()), 
+                    cv2.COLOR_BGR2GRAY)
+            except Exception as e:
+                print('Capture failed:', repr(e))
+                with self._condition:
+                    self._error = e
+                    self._condition.notify_all()
+            else:
+                with self._condition:
+                    self.buffer.append((start, frame))
+                    self.captures += 1
+                    self._condition.notify_all()
+            self._stopped.wait(max(self.interval - (time.time() - start), 0))
+
+    def latest(self, after=0):
+        with self._condition:
+            self._condition.wait_for(lambda: self._error is not None or 
+                (self.buffer and self.buffer[-1][0] > after))
+            if self._error is not None:
+                error, self._error = self._error, None
+                raise error
+            return self.buffer[-1]
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+'''
+
+Runs mouse actions on a background thread so the caller can carry on while 
+the mouse moves. Until start() is called, submitted actions run immediately 
+on the calling thread.
+
+wait() blocks until every submitted action has finished. An action that 
+raised does not stop the thread; its error is raised from the next wait() 
+instead, and the actions queued after it are discarded.
+
+'''
+class ActionQueue:
+    def __init__(self):
+        self._queue = None
+        self._thread = None
+        self._error = None
+
+    def start(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            func, args = self._queue.get()
+            try:
+                # later actions assume this one happened, so skip them.
+                if self._error is None:
+                    func(*args)
+            except Exception as e:
+                print('Action failed:', repr(e))
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def submit(self, func, *args):
+        if self._queue is None:
+            func(*args)
+        else:
+            self._queue.put((func, args))
+
+    def wait(self):
+        if self._queue is not None:
+            self._queue.join()
+            if self._error is not None:
+                error, self._error = self._error, None
+                raise error
+
+actions = ActionQueue()
+
+
+'''
+
+Keeps the most recent full screen capture, already converted to grayscale, 
+so that any number of template searches can run against one screenshot.
+
+input :
+max_age : seconds a capture stays fresh. A search asking for a frame older 
+than this takes a new screenshot.
+
+grab() returns the current grayscale frame as a numpy array, capturing a new 
+one if needed. invalidate() forces the next grab() to capture, and is called 
+after every click since the screen is expected to change.
+
+After start_capture(), frames come from a CaptureThread instead and grab() 
+returns the newest one without blocking, unless it was captured before the 
+last invalidate() or a mouse action is still running.
+
+'''
+class FrameProvider:
+    def __init__(self, max_age=0.5):
+        self.max_age = max_age
+        self._frame = None
+        self._timestamp = 0
+        self._not_before = 0
+        self._capture = None
+        self.captures = 0
+        self.last_grab_time = 0
+
+    def start_capture(self, interval=0.05, size=8):
+        self._capture = CaptureThread(interval, size)
+        self._capture.start()
+
+    def stop_capture(self):
+        if self._capture is not None:
+            self._capture.stop()
+            self._capture = None
+
+    def grab(self, max_age=None):
+        if max_age is None:
+            max_age = self.max_age
+        start = time.perf_counter()
+        if self._capture is not None:
+            actions.wait()
+            after = max(self._not_before, time.time() - max_age)
+            self._timestamp, self._frame = self._capture.latest(after)
+            self.last_grab_time += time.perf_counter() - start
+            return self._frame
+
+        now = time.time()
+        if self._frame is None or now - self._timestamp > max_age:
+            im = pyautogui.screenshot()
+            #im.save('testarea.png') usefull for debugging purposes, this will save the captured region as "testarea.png"
+            self._frame = cv2.cvtColor(np.array(im), cv2.COLOR_BGR2GRAY)
+            self._timestamp = now
+            self.captures += 1
+            self.last_grab_time += time.perf_counter() - start
+        return self._frame
+
+    def invalidate(self):
+        self._frame = None
+        self._not_before = time.time()
+
+frames = FrameProvider()
+
+
+'''
+
+Grayscale template images loaded once and kept in memory, keyed by path.
+
+get(image) returns the template as a numpy array, loading it on first use and 
+again whenever the file's modification time changes. size(image) returns its 
+(width, height). preload(*directories) loads every png in the given 
+directories up front.
+
+A missing or unreadable file raises FileNotFoundError.
+
+'''
+class TemplateRegistry:
+    def __init__(self):
+        self._templates = {}
+
+    def preload(self, *directories):
+        for directory in directories:
+            for path in sorted(glob.glob(os.path.join(directory, '*.png'))):
+                self.get(path)
+
+    def get(self, image):
+        path = os.path.normpath(image)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            raise FileNotFoundError(image)
+        cached = self._templates.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        template = cv2.imread(path, 0)
+        if template is None:
+            raise FileNotFoundError(image)
+        self._templates[path] = (mtime, template)
+        return template
+
+    def size(self, image):
+        height, width = self.get(image).shape
+        return width, height
+
+templates = TemplateRegistry()
+
+
+'''
+
+Number of image pyramid levels used by match_template. 1 matches at full 
+resolution only. With more levels the frame and template are halved 
+levels-1 times, matched there, and only the best few coarse matches are 
+refined at full resolution.
+
+'''
+pyramid_levels = 1
+
+
+'''
+
+Matches a template against a grayscale image.
+
+input :
+img_gray : grayscale numpy array to search in
+image : path to the template image file
+levels : image pyramid levels to use, defaults to pyramid_levels
+candidates : number of coarse matches to refine at full resolution
+
+returns :
+the best match score and the top left corner of the best match as (max_val, max_loc)
+
+'''
+def match_template(img_gray, image, levels=None, candidates=3):
+    template = templates.get(image)
+    if levels is None:
+        levels = pyramid_levels
+    # keep at least 8 pixels of template at the coarsest level.
+    while levels > 1 and min(template.shape) >> (levels-1) < 8:
+        levels -= 1
+    if levels > 1:
+        return _match_pyramid(img_gray, template, levels, candidates)
+
+    res = cv2.matchTemplate(img_gray, template, cv2.TM_CCOEFF_NORMED)
+    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
+    return max_val, max_loc
+
+def _match_pyramid(img_gray, template, levels, candidates):
+    small_img, small_template = img_gray, template
+    for _ in range(levels-1):
+        small_img = cv2.pyrDown(small_img)
+        small_template = cv2.pyrDown(small_template)
+    scale = 2**(levels-1)
+
+    res = cv2.matchTemplate(small_img, small_template, cv2.TM_CCOEFF_NORMED)
+    th, tw = small_template.shape
+    h, w = template.shape
+    best = (-1.0, (0, 0))
+    for _ in range(candidates):
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
+        if max_val < -0.5:
+            break
+        # do not pick the same coarse match again.
+        res[max(max_loc[1]-th//2, 0):max_loc[1]+th//2+1,
+            max(max_loc[0]-tw//2, 0):max_loc[0]+tw//2+1] = -1
+
+        x0 = max(max_loc[0]*scale - scale, 0)
+        y0 = max(max_loc[1]*scale - scale, 0)
+        area = img_gray[y0:max_loc[1]*scale+h+scale, 
+            x0:max_loc[0]*scale+w+scale]
+        if area.shape[0] < h or area.shape[1] < w:
+            continue
+        fine = cv2.matchTemplate(area, template, cv2.TM_CCOEFF_NORMED)
+        min_val, fine_val, min_loc, fine_loc = cv2.minMaxLoc(fine)
+        if fine_val > best[0]:
+            best = (fine_val, (x0+fine_loc[0], y0+fine_loc[1]))
+    return best
+
+
+'''
+
+Compares pyramid matching against the exact full resolution matcher.
+
+input :
+screenshots : paths to saved screenshots
+images : paths to the template images to look for in each screenshot
+levels : image pyramid levels to test
+precision : threshold deciding whether a template is found
+
+returns :
+a dict with the number of searches, how many agreed with the exact matcher 
+on whether the template was found and, if so, where (within 2 pixels), the 
+largest score difference, and the total time taken by each matcher.
+
+'''
+def pyramid_accuracy(screenshots, images, levels, precision=0.8):
+    stats = {'searches': 0, 'agreed': 0, 'max_score_error': 0.0,
+        'exact_time': 0.0, 'pyramid_time': 0.0}
+    for screenshot in screenshots:
+        img_gray = cv2.imread(screenshot, 0)
+        for image in images:
+            start = time.perf_counter()
+            exact_val, exact_loc = match_template(img_gray, image, 1)
+            middle = time.perf_counter()
+            val, loc = match_template(img_gray, image, levels)
+            end = time.perf_counter()
+
+            stats['searches'] += 1
+            stats['exact_time'] += middle - start
+            stats['pyramid_time'] += end - middle
+            stats['max_score_error'] = max(stats['max_score_error'], 
+                abs(exact_val - val))
+            if (exact_val >= precision) != (val >= precision):
+                continue
+            if exact_val < precision or (abs(exact_loc[0] - loc[0]) <= 2
+                    and abs(exact_loc[1] - loc[1]) <= 2):
+                stats['agreed'] += 1
+    return stats
+
+
+'''
+
+Skips template matching when the searched part of the screen has not changed 
+since the last search for the same image in the same region, and reuses that 
+search's result instead.
+
+The searched image is shrunk by scale with area averaging, and counts as 
+unchanged if no cell's brightness moved by more than threshold. matched and 
+skipped count the searches that ran and that were skipped.
+
+'''
+class ChangeGate:
+    def __init__(self, threshold=4, scale=8, enabled=True):
+        self.threshold = threshold
+        self.scale = scale
+        self.enabled = enabled
+        self.matched = 0
+        self.skipped = 0
+        self.last_skipped = False
+        self.last_match_time = 0
+        self._last = {}
+
+    def _thumbnail(self, img_gray):
+        height, width = img_gray.shape
+        return cv2.resize(img_gray, 
+            (max(width // self.scale, 1), max(height // self.scale, 1)),
+            interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def match(self, img_gray, image, region=None):
+        start = time.perf_counter()
+        try:
+            return self._match(img_gray, image, region)
+        finally:
+            self.last_match_time = time.perf_counter() - start
+
+    def _match(self, img_gray, image, region):
+        self.last_skipped = False
+        if not self.enabled:
+            return match_template(img_gray, image)
+
+        # a reloaded template is a new array, so it is matched again.
+        key = (os.path.normpath(image), region, pyramid_levels, 
+            id(templates.get(image)))
+        thumbnail = self._thumbnail(img_gray)
+        last = self._last.get(key)
+        if last is not None and last[0].shape == thumbnail.shape and \
+                np.abs(thumbnail - last[0]).max() <= self.threshold:
+            self.skipped += 1
+            self.last_skipped = True
+            return last[1]
+
+        result = match_template(img_gray, image)
+        self._last[key] = (thumbnail, result)
+        self.matched += 1
+        return result
+
+    def reset(self):
+        self._last.clear()
+        self.matched = self.skipped = 0
+
+gate = ChangeGate()
+
+
+'''
+
+Callables run with a dict describing each search and wait, for profiling. 
+Search records have kind 'search', the template, the region searched (None 
+for the whole screen), capture_time and match_time in seconds, the score, 
+whether it was found and whether the change gate skipped the match. Wait 
+records have kind 'wait', the template and wait_time in seconds. Code that 
+matches templates itself reports its searches with report_search().
+
+'''
+search_hooks = []
+
+def _report_search(image, region, max_val, precision):
+    report_search(image, region, max_val, precision, gate.last_match_time, 
+        gate.last_skipped)
+
+def report_search(image, region, max_val, precision, match_time, 
+        skipped=False):
+    if not search_hooks:
+        return
+    record = {
+        'kind': 'search',
+        'time': time.time(),
+        'template': image,
+        'region': region,
+        'capture_time': frames.last_grab_time,
+        'match_time': match_time,
+        'score': float(max_val),
+        'found': bool(max_val >= precision),
+        'skipped': skipped,
+    }
+    # the capture is only counted against the first search using it.
+    frames.last_grab_time = 0
+    for hook in search_hooks:
+        hook(record)
+
+def report_wait(image, wait_time):
+    record = {
+        'kind': 'wait',
+        'time': time.time(),
+        'template': image,
+        'wait_time': wait_time,
+    }
+    for hook in search_hooks:
+        hook(record)
 
 
 '''
@@ -44,15 +483,14 @@ the top left corner coordinates of the element if found as an array [x,y] or [-1
 '''
 def imagesearcharea(image, x1,y1,x2,y2, precision=0.8, im=None) :
     if im is None :
-        im = region_grabber(region=(x1, y1, x2, y2))
-        #im.save('testarea.png') usefull for debugging purposes, this will save the captured region as "testarea.png"
-
-    img_rgb = np.array(im)
-    img_gray = cv2.cvtColor(img_rgb, cv2.COLOR_BGR2GRAY)
-    template = cv2.imread(image, 0)
+        img_gray = frames.grab()[y1:y2, x1:x2]
+        max_val, max_loc = gate.match(img_gray, image, (x1, y1, x2, y2))
+        _report_search(image, (x1, y1, x2, y2), max_val, precision)
+    else :
+        img_rgb = np.array(im)
+        img_gray = cv2.cvtColor(img_rgb, cv2.COLOR_BGR2GRAY)
+        max_val, max_loc = match_template(img_gray, image)
 
-    res = cv2.matchTemplate(img_gray, template, cv2.TM_CCOEFF_NORMED)
-    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
     if max_val < precision:
         return [-1, -1]
     return max_loc
@@ -75,11 +513,14 @@ time : time taken for the mouse to move from where it was to the new position
 '''
 
 def click_image(image,pos,  action, timestamp,offset=5):
-    img = cv2.imread(image)
-    height, width, channels = img.shape
-    pyautogui.moveTo(pos[0] + r(width / 2, offset), pos[1] + r(height / 2,offset),
-                     timestamp)
+    width, height = templates.size(image)
+    actions.submit(_click, pos[0] + r(width / 2, offset), 
+        pos[1] + r(height / 2,offset), action, timestamp)
+
+def _click(x, y, action, timestamp):
+    pyautogui.moveTo(x, y, timestamp)
     pyautogui.click(button=action)
+    frames.invalidate()
 
 
 '''
@@ -89,28 +530,106 @@ input :
 
 image : path to the image file (see opencv imread for supported types)
 precision : the higher, the lesser tolerant and fewer false positives are found default is 0.8
-im : a PIL image, usefull if you intend to search the same unchanging region for several elements
+max_age : reuse the last screen capture if it is at most this many seconds old, defaults to frames.max_age
 
 returns :
 the top left corner coordinates of the element if found as an array [x,y] or [-1,-1] if not
 
 '''
-def imagesearch(image, precision=0.8):
-    im = pyautogui.screenshot()
-    #im.save('testarea.png') usefull for debugging purposes, this will save the captured region as "testarea.png"
-    img_rgb = np.array(im)
-    img_gray = cv2.cvtColor(img_rgb, cv2.COLOR_BGR2GRAY)
-    template = cv2.imread(image, 0)
-    template.shape[::-1]
+def imagesearch(image, precision=0.8, max_age=None):
+    img_gray = frames.grab(max_age)
 
-    res = cv2.matchTemplate(img_gray, template, cv2.TM_CCOEFF_NORMED)
-    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
+    max_val, max_loc = gate.match(img_gray, image)
+    _report_search(image, None, max_val, precision)
     print(image, max_val)
     if max_val < precision:
         return [-1,-1]
     return max_loc
 
 
+'''
+
+Search regions for each template, as a map of image path to the region 
+(x1, y1, x2, y2) of the screen it appears in.
+
+Regions are learned from full screen hits, padded by margin pixels, and grown 
+to cover any later hit outside them. When a path is set they are loaded from 
+and saved to that json file, which can also be edited by hand.
+
+'''
+class RegionProfiles:
+    def __init__(self, path=None, margin=20):
+        self.path = path
+        self.margin = margin
+        self.regions = {}
+
+    def load(self, path):
+        self.path = path
+        if os.path.exists(path):
+            with open(path) as f:
+                self.regions = {os.path.normpath(k): tuple(v) 
+                    for k, v in json.load(f).items()}
+
+    def save(self):
+        if self.path is not None:
+            with open(self.path, 'w') as f:
+                json.dump(self.regions, f, indent=2, sort_keys=True)
+
+    def region(self, image):
+        return self.regions.get(os.path.normpath(image))
+
+    def learn(self, image, pos):
+        width, height = templates.size(image)
+        x1 = max(pos[0] - self.margin, 0)
+        y1 = max(pos[1] - self.margin, 0)
+        x2 = pos[0] + width + self.margin
+        y2 = pos[1] + height + self.margin
+        old = self.region(image)
+        if old is not None:
+            x1, y1 = min(x1, old[0]), min(y1, old[1])
+            x2, y2 = max(x2, old[2]), max(y2, old[3])
+        self.regions[os.path.normpath(image)] = (x1, y1, x2, y2)
+        self.save()
+
+regions = RegionProfiles()
+
+
+'''
+Searchs for an image within its learned region of the screen, falling back to 
+the whole screen if there is no region yet or it is not found there. The 
+fallback is skipped while the region looks the same as when the image was 
+last not found in it, as the whole screen was searched then.
+
+input :
+
+image : path to the image file (see opencv imread for supported types)
+precision : the higher, the lesser tolerant and fewer false positives are found default is 0.8
+max_age : reuse the last screen capture if it is at most this many seconds old, defaults to frames.max_age
+
+returns :
+the top left corner coordinates of the element if found as an array [x,y] or [-1,-1] if not
+
+'''
+def imagesearch_roi(image, precision=0.8, max_age=None):
+    region = regions.region(image)
+    if region is not None:
+        x1, y1, x2, y2 = region
+        img_gray = frames.grab(max_age)[y1:y2, x1:x2]
+        width, height = templates.size(image)
+        if img_gray.shape[0] >= height and img_gray.shape[1] >= width:
+            max_val, max_loc = gate.match(img_gray, image, region)
+            _report_search(image, region, max_val, precision)
+            if max_val >= precision:
+                return (x1 + max_loc[0], y1 + max_loc[1])
+            if gate.last_skipped:
+                return [-1,-1]
+
+    pos = imagesearch(image, precision, max_age)
+    if pos[0] != -1:
+        regions.learn(image, pos)
+    return pos
+
+
 
 '''
 Searchs for an image on screen continuously until it's found.
@@ -129,6 +648,7 @@ def imagesearch_loop(image, timesample, precision=0.8):
     while pos[0] == -1:
         print(image+" not found, waiting")
         time.sleep(timesample)
+        frames.invalidate()
         pos = imagesearch(image, precision)
     return pos
 
@@ -151,6 +671,7 @@ def imagesearch_numLoop(image, timesample, maxSamples, precision=0.8):
     while pos[0] == -1:
         print(image+" not found, waiting")
         time.sleep(timesample)
+        frames.invalidate()
         pos = imagesearch(image, precision)
         count = count + 1
         if count>maxSamples:
@@ -178,9 +699,88 @@ def imagesearch_region_loop(image, timesample, x1, y1, x2, y2, precision=0.8):
 
     while pos[0] == -1:
         time.sleep(timesample)
+        frames.invalidate()
         pos = imagesearcharea(image, x1, y1, x2, y2, precision)
     return pos
 
+'''
+Greedy non-maximum suppression over scored points.
+
+input :
+xs, ys, scores : numpy arrays of candidate positions and their scores
+min_distance : kept points are at least this many pixels apart
+
+returns :
+the indices of the kept points, best score first.
+
+'''
+def suppress(xs, ys, scores, min_distance):
+    alive = np.ones(len(scores), dtype=bool)
+    kept = []
+    for i in np.argsort(-scores, kind='stable'):
+        if not alive[i]:
+            continue
+        kept.append(i)
+        alive &= (xs - xs[i])**2 + (ys - ys[i])**2 >= min_distance**2
+    return kept
+
+'''
+Finds the distinct peaks of a matchTemplate result.
+
+Points above the threshold are first reduced to the best one in each grid 
+cell small enough that two kept points can never share a cell, and then 
+suppressed greedily, so the work stays small even when thousands of points 
+pass a low threshold.
+
+input :
+res : result of cv2.matchTemplate
+threshold : minimum score of a match
+min_distance : matches are at least this many pixels apart
+
+returns :
+a list of (x, y, score) tuples, best score first.
+
+'''
+def non_max_suppression(res, threshold, min_distance=30):
+    ys, xs = np.nonzero(res >= threshold)
+    if not len(xs):
+        return []
+    scores = res[ys, xs]
+
+    cell = max(int(min_distance / np.sqrt(2)), 1)
+    cells = (ys // cell) * (res.shape[1] // cell + 1) + xs // cell
+    order = np.lexsort((-scores, cells))
+    first = np.unique(cells[order], return_index=True)[1]
+    best = order[first]
+    xs, ys, scores = xs[best], ys[best], scores[best]
+
+    return [(int(xs[i]), int(ys[i]), float(scores[i])) 
+        for i in suppress(xs, ys, scores, min_distance)]
+
+'''
+Searches for every distinct occurrence of an image on the screen.
+
+input :
+image : path to the target image file (see opencv imread for supported types)
+precision : the higher, the lesser tolerant and fewer false positives are found default is 0.8
+min_distance : occurrences closer than this many pixels count as one
+img_gray : grayscale image to search in, defaults to the current screen
+
+returns :
+a list of (x, y, score) tuples for the top left corner of each occurrence, best score first.
+
+'''
+def imagesearch_all(image, precision=0.8, min_distance=30, img_gray=None):
+    if img_gray is None:
+        img_gray = frames.grab()
+    template = templates.get(image)
+    start = time.perf_counter()
+    res = cv2.matchTemplate(img_gray, template, cv2.TM_CCOEFF_NORMED)
+    found = non_max_suppression(res, precision, min_distance)
+    report_search(image, None, res.max() if res.size else 0, precision, 
+        time.perf_counter() - start)
+    return found
+
 '''
 Searches for an image on the screen and counts the number of occurrences.
 
@@ -189,24 +789,11 @@ image : path to the target image file (see opencv imread for supported types)
 precision : the higher, the lesser tolerant and fewer false positives are found default is 0.9
 
 returns :
-the number of times a given image appears on the screen.
-optionally an output image with all the occurances boxed with a red outline.
+the number of distinct times a given image appears on the screen.
 
 '''
 def imagesearch_count(image, precision=0.9):
-    img_rgb = pyautogui.screenshot()
-    img_rgb = np.array(img_rgb)
-    img_gray = cv2.cvtColor(img_rgb, cv2.COLOR_BGR2GRAY)
-    template = cv2.imread(image, 0)
-    w, h = template.shape[::-1]
-    res = cv2.matchTemplate(img_gray, template, cv2.TM_CCOEFF_NORMED)
-    loc = np.where(res >= precision)
-    count = 0
-    for pt in zip(*loc[::-1]):  # Swap columns and rows
-        #cv2.rectangle(img_rgb, pt, (pt[0] + w, pt[1] + h), (0, 0, 255), 2) // Uncomment to draw boxes around found occurances
-        count = count + 1
-    #cv2.imwrite('result.png', img_rgb) // Uncomment to write output image with boxes drawn around occurances
-    return count
+    return len(imagesearch_all(image, precision))
 
 def r(num, rand):
     return num + rand*random.random()
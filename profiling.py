@@ -0,0 +1,172 @@
+import csv
+import imagesearch
+import json
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+
+'''
+
+Records every image search, wait and named phase while active, so the time
+spent in a bot run can be broken down afterwards.
+
+Searches are recorded through imagesearch.search_hooks, with their capture
+and match times, template, score and whether they were found. Phases are
+named sections of a run timed with phase(), and may be nested. Every record
+is tagged with the current run number, which new_run() increments.
+
+Use as a context manager; while inside it, the module level phase() and
+record_wait() report to this profiler and do nothing otherwise.
+
+'''
+class Profiler:
+    def __init__(self):
+        self.searches = []
+        self.waits = []
+        self.phases = []
+        self.run = 0
+        self._previous = None
+
+    def __enter__(self):
+        global active
+        self._previous = active
+        active = self
+        imagesearch.search_hooks.append(self._record)
+        return self
+
+    def __exit__(self, *exc):
+        global active
+        imagesearch.search_hooks.remove(self._record)
+        active = self._previous
+        return False
+
+    def _record(self, record):
+        record = dict(record, run=self.run)
+        if record['kind'] == 'wait':
+            self.waits.append(record)
+        else:
+            self.searches.append(record)
+
+    def new_run(self):
+        self.run += 1
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append({
+                'run': self.run,
+                'phase': name,
+                'duration': time.perf_counter() - start,
+            })
+
+    '''
+
+    Totals for each run, as a list of dicts with the run number, the number
+    of searches, the total capture, match and wait time, and the total time
+    of each phase under 'phase: <name>'.
+
+    '''
+    def summary(self):
+        runs = OrderedDict()
+        def row(run):
+            if run not in runs:
+                runs[run] = OrderedDict((
+                    ('run', run), ('searches', 0), ('skipped', 0),
+                    ('capture_time', 0), ('match_time', 0), ('wait_time', 0)))
+            return runs[run]
+
+        for s in self.searches:
+            r = row(s['run'])
+            r['searches'] += 1
+            r['skipped'] += s['skipped']
+            r['capture_time'] += s['capture_time']
+            r['match_time'] += s['match_time']
+        for w in self.waits:
+            row(w['run'])['wait_time'] += w['wait_time']
+        for p in self.phases:
+            r = row(p['run'])
+            key = 'phase: ' + p['phase']
+            r[key] = r.get(key, 0) + p['duration']
+        return [runs[run] for run in sorted(runs)]
+
+    '''
+
+    Time spent per template, as a dict of template to the number of
+    searches and the total capture, match and wait time, slowest first.
+
+    '''
+    def by_template(self):
+        totals = defaultdict(lambda: defaultdict(lambda: 0))
+        for s in self.searches:
+            t = totals[s['template']]
+            t['searches'] += 1
+            t['capture_time'] += s['capture_time']
+            t['match_time'] += s['match_time']
+        for w in self.waits:
+            totals[w['template']]['wait_time'] += w['wait_time']
+        total = lambda t: t['capture_time'] + t['match_time'] + t['wait_time']
+        return OrderedDict((name, dict(t)) for name, t in
+            sorted(totals.items(), key=lambda x: total(x[1]), reverse=True))
+
+    '''
+
+    Histogram of one field of the search records, such as 'match_time',
+    'capture_time' or 'score', or of 'wait_time' over the waits or
+    'duration' over the phases. Returns (counts, bin edges) as lists.
+
+    '''
+    def histogram(self, field, bins=20):
+        if field == 'wait_time':
+            records = self.waits
+        elif field == 'duration':
+            records = self.phases
+        else:
+            records = self.searches
+        values = np.array([r[field] for r in records], dtype=float)
+        if not len(values):
+            return [], []
+        counts, edges = np.histogram(values, bins)
+        return counts.tolist(), edges.tolist()
+
+    def to_json(self, path, bins=20):
+        with open(path, 'w') as f:
+            json.dump({
+                'runs': self.summary(),
+                'templates': self.by_template(),
+                'histograms': {field: self.histogram(field, bins) for field
+                    in ('capture_time', 'match_time', 'score', 'wait_time')},
+                'searches': self.searches,
+                'waits': self.waits,
+                'phases': self.phases,
+            }, f, indent=2)
+
+    def to_csv(self, path):
+        rows = self.summary()
+        fields = []
+        for r in rows:
+            fields.extend(k for k in r if k not in fields)
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fields, restval=0)
+            writer.writeheader()
+            writer.writerows(rows)
+
+active = None
+
+def phase(name):
+    if active is None:
+        return _nothing()
+    return active.phase(name)
+
+@contextmanager
+def _nothing():
+    yield
+
+def record_wait(image, wait_time):
+    if active is not None:
+        imagesearch.report_wait(image, wait_time)
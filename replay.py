@@ -0,0 +1,211 @@
+import glob
+import json
+import os
+import sys
+import time
+import types
+
+import cv2
+import numpy as np
+
+
+'''
+
+Raised when a replay runs out of recorded frames.
+
+'''
+class ReplayFinished(Exception):
+    pass
+
+
+'''
+
+Replays a recorded sequence of screenshots in place of the real screen, so the 
+bot can run without a game window.
+
+While active, a stand-in pyautogui module returns the recorded frames from 
+screenshot() and logs mouse actions in clicks instead of performing them, and 
+time.sleep returns immediately. Each frame is shown until the bot clicks or 
+until it has been captured captures_per_frame times, after which the next 
+frame is shown. ReplayFinished is raised once every frame has been used.
+
+input :
+frames : directory of png screenshots, replayed in file name order
+captures_per_frame : screenshots taken of one frame before moving on without a click
+
+'''
+class ReplayScreen:
+    def __init__(self, frames, captures_per_frame=3):
+        self.paths = sorted(glob.glob(os.path.join(frames, '*.png')))
+        self.captures_per_frame = captures_per_frame
+        self.index = 0
+        self.captures = 0
+        self.clicks = []
+        self.position = (0, 0)
+        self._cache = {}
+        self._saved = {}
+        self.module = self._make_module()
+
+    def _make_module(self):
+        module = types.ModuleType('pyautogui')
+        module.screenshot = self.screenshot
+        module.moveTo = self.moveTo
+        module.moveRel = self.moveRel
+        module.click = self.click
+        module.mouseDown = self.mouseDown
+        module.mouseUp = self.mouseUp
+        return module
+
+    def _frame(self):
+        if self.index >= len(self.paths):
+            raise ReplayFinished()
+        if self.index not in self._cache:
+            image = cv2.imread(self.paths[self.index])
+            self._cache = {self.index: cv2.cvtColor(image, cv2.COLOR_BGR2RGB)}
+        return self._cache[self.index]
+
+    def _advance(self):
+        self.index += 1
+        self.captures = 0
+
+    def screenshot(self, region=None):
+        if self.captures >= self.captures_per_frame:
+            self._advance()
+        frame = self._frame()
+        self.captures += 1
+        if region is not None:
+            x, y, width, height = region
+            frame = frame[y:y+height, x:x+width]
+        return frame.copy()
+
+    def _log(self, action, **kwargs):
+        self.clicks.append(dict(frame=self.index, action=action, 
+            position=self.position, **kwargs))
+
+    def moveTo(self, x, y, duration=0, *args, **kwargs):
+        self.position = (int(x), int(y))
+
+    def moveRel(self, x, y, duration=0, *args, **kwargs):
+        self.position = (self.position[0] + int(x), self.position[1] + int(y))
+
+    def click(self, *args, button='left', **kwargs):
+        self._log('click', button=button)
+        self._advance()
+
+    def mouseDown(self, *args, **kwargs):
+        self._log('mouseDown')
+
+    def mouseUp(self, *args, **kwargs):
+        self._log('mouseUp')
+        self._advance()
+
+    def __enter__(self):
+        self._saved['pyautogui'] = sys.modules.get('pyautogui')
+        self._saved['sleep'] = time.sleep
+        sys.modules['pyautogui'] = self.module
+        time.sleep = lambda seconds: None
+        for name in ('imagesearch', 'auto_snowflakes'):
+            if name in sys.modules:
+                sys.modules[name].pyautogui = self.module
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        time.sleep = self._saved['sleep']
+        real = self._saved['pyautogui']
+        if real is None:
+            del sys.modules['pyautogui']
+        else:
+            sys.modules['pyautogui'] = real
+        for name in ('imagesearch', 'auto_snowflakes'):
+            if name in sys.modules and real is not None:
+                sys.modules[name].pyautogui = real
+
+
+'''
+
+Saves a screenshot of the real screen every interval seconds into a directory, 
+for later use with ReplayScreen. Stops after count frames, or runs until 
+interrupted if count is None.
+
+'''
+def record(out_dir, interval=0.5, count=None):
+    import pyautogui
+    os.makedirs(out_dir, exist_ok=True)
+    n = 0
+    while count is None or n < count:
+        start = time.time()
+        pyautogui.screenshot().save(os.path.join(out_dir, '%06d.png' % n))
+        n += 1
+        time.sleep(max(interval - (time.time() - start), 0))
+
+
+'''
+
+Runs auto_snowflakes.run_snowflakes against a recorded sequence of frames and 
+reports how long searching took.
+
+returns :
+a dict with the frames replayed, number of template matches, matches skipped 
+by the change gate, search latency per match and per frame, mouse actions 
+and total run time.
+
+'''
+def benchmark(frames, captures_per_frame=3):
+    with ReplayScreen(frames, captures_per_frame) as screen:
+        import imagesearch
+        import auto_snowflakes
+
+        imagesearch.frames.invalidate()
+        imagesearch.gate.reset()
+        match_times = []
+        frame_times = {}
+        real_match = cv2.matchTemplate
+
+        def timed_match(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return real_match(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                match_times.append(elapsed)
+                frame_times[screen.index] = \
+                    frame_times.get(screen.index, 0) + elapsed
+
+        cv2.matchTemplate = timed_match
+        start = time.perf_counter()
+        try:
+            auto_snowflakes.run_snowflakes()
+            finished = True
+        except ReplayFinished:
+            finished = False
+        finally:
+            total = time.perf_counter() - start
+            cv2.matchTemplate = real_match
+
+    matches = len(match_times)
+    match_times = np.array(match_times or [0.0])
+    per_frame = np.array(list(frame_times.values()) or [0.0])
+    return {
+        'frames': min(screen.index + 1, len(screen.paths)),
+        'completed_run': finished,
+        'matches': matches,
+        'skipped_matches': imagesearch.gate.skipped,
+        'match_ms_mean': 1000 * float(match_times.mean()),
+        'match_ms_p95': 1000 * float(np.percentile(match_times, 95)),
+        'frame_search_ms_mean': 1000 * float(per_frame.mean()),
+        'frame_search_ms_max': 1000 * float(per_frame.max()),
+        'mouse_actions': len(screen.clicks),
+        'total_s': total,
+    }
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in ('record', 'benchmark'):
+        print('Usage: replay.py record DIR [interval] | replay.py benchmark DIR')
+        sys.exit(1)
+    frames_dir = os.path.abspath(sys.argv[2])
+    if sys.argv[1] == 'record':
+        record(frames_dir, *(float(x) for x in sys.argv[3:4]))
+    else:
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        print(json.dumps(benchmark(frames_dir), indent=2))
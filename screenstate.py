@@ -0,0 +1,110 @@
+import imagesearch
+import time
+from collections import OrderedDict, defaultdict
+
+import cv2
+import numpy as np
+
+
+'''
+
+Watches the screen and classifies it into one of a set of named states, 
+pushing an event to the registered handlers whenever the state changes. A 
+handler registered with repeat is also run again every repeat seconds for as 
+long as its state lasts, such as tapping through screens with no known image 
+(the None state).
+
+Each tick captures one frame and searches it for each state's image in 
+order; the first one found is the current state, or None if none are. The 
+polling interval starts at min_interval and grows by backoff up to 
+max_interval while the screen stays still, and drops back to min_interval 
+when the state changes or the screen is visibly moving.
+
+input :
+states : list or OrderedDict of state name to (image path, precision)
+min_interval, max_interval : bounds on the seconds between ticks
+backoff : factor the interval grows by on each unchanged tick
+motion_threshold : mean pixel difference of a downscaled frame above which the screen counts as moving
+
+'''
+class ScreenWatcher:
+    def __init__(self, states, min_interval=0.1, max_interval=0.5, 
+            backoff=1.5, motion_threshold=2.0):
+        self.states = OrderedDict(states)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.motion_threshold = motion_threshold
+        self.handlers = defaultdict(list)
+        self.state = None
+        self._last_run = {}
+        self.interval = min_interval
+        self._thumbnail = None
+
+    def on(self, state, handler, repeat=None):
+        self.handlers[state].append((handler, repeat))
+        return handler
+
+    def _run_handlers(self, previous):
+        now = time.time()
+        changed = self.state != previous
+        for handler, repeat in self.handlers[self.state]:
+            key = (self.state, handler)
+            if changed or repeat is not None and \
+                    now - self._last_run.get(key, 0) >= repeat:
+                handler(self.state, previous)
+                self._last_run[key] = time.time()
+                # the handler has probably changed the screen.
+                self.interval = self.min_interval
+
+    def _moving(self, frame):
+        thumbnail = cv2.resize(frame, (frame.shape[1]//16, frame.shape[0]//16),
+            interpolation=cv2.INTER_AREA).astype(np.int16)
+        moving = self._thumbnail is not None and \
+            self._thumbnail.shape == thumbnail.shape and \
+            np.abs(thumbnail - self._thumbnail).mean() > self.motion_threshold
+        self._thumbnail = thumbnail
+        return moving
+
+    def classify(self):
+        for name, (image, precision) in self.states.items():
+            if imagesearch.imagesearch_roi(image, precision)[0] != -1:
+                return name
+        return None
+
+    def tick(self):
+        imagesearch.frames.invalidate()
+        moving = self._moving(imagesearch.frames.grab())
+        previous, self.state = self.state, self.classify()
+
+        if self.state != previous or moving:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, 
+                self.max_interval)
+
+        if self.state != previous:
+            print('Screen', previous, '->', self.state)
+        self._run_handlers(previous)
+        return self.state
+
+    def run(self, until):
+        while True:
+            state = self.tick()
+            if until(state):
+                return state
+            time.sleep(self.interval)
+
+    def wait_for(self, *states):
+        return self.run(lambda state: state in states)
+
+
+'''
+
+Waits until an image appears on screen, polling adaptively, and returns its 
+position like imagesearch.
+
+'''
+def wait_for_image(image, precision=0.8):
+    ScreenWatcher([(image, (image, precision))]).wait_for(image)
+    return imagesearch.imagesearch_roi(image, precision)
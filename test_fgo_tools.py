@@ -1,8 +1,12 @@
 from fgo_tools import *
-from fgo_tools_experimental import SummerProjectsOptimiser2
+from fgo_tools_experimental import SummerProjectsOptimiser2, \
+    SummerProjectsOptimiser3, CampaignOptimiser
 import pytest
 import os
 import json
+import math
+import random
+from collections import OrderedDict
 
 @pytest.fixture
 def drops_data():
@@ -24,6 +28,272 @@ class TestDropsData:
             'mat 1': 10
         })) == Items({'mat 1': 1001.5})
 
+    def test_drops_matrix(self):
+        data = DropsData({
+            'location 1': {'mat 1': {'initial': 1, 'stacks': 2}},
+            'location 2': {
+                'mat 1': {'initial': 3, 'stacks': 1},
+                'mat 2': {'initial': 5, 'stacks': 4}
+            }
+        })
+        bonuses = [Items({'mat 1': 1}), Items({'mat 2': 2})]
+        drops = data.drops_matrix(data.bonus_vectors(bonuses)[:, None])
+
+        assert drops.shape == (2, 2, 2)
+        for b, bonus in enumerate(bonuses):
+            for l, loc in enumerate(data.locations):
+                expected = data.drops_with_bonus(loc, bonus)
+                for mat, num in expected.items():
+                    assert drops[b, l, data.materials.position(mat)] == num
+
+    def test_exact_best_party(self):
+        data = DropsData({
+            'location': {
+                'a': {'initial': 1, 'stacks': 10},
+                'b': {'initial': 1, 'stacks': 5}
+            }
+        })
+        available = PartySetup(
+            servants=[Items(a=2)]*5 + [Items(a=1, b=3)]*5 + [Items()],
+            craft_essences=[Items(c=5)],
+            support=[Items(a=1), Items(b=4)]
+        )
+        exact = data.best_party('location', available, exact=True)
+
+        assert exact.servants == [Items(a=1, b=3)]*5
+        assert exact.craft_essences == []
+        assert exact.support == [Items(b=4)]
+
+        greedy = data.best_party('location', available)
+        value = lambda party: sum(
+            data.drops_with_party('location', party).values())
+        assert value(exact) > value(greedy)
+
+    def test_variance(self):
+        data = DropsData({
+            'location': {
+                'a': {'samples': [[1, 2], [3, 4]]},
+                'b': {'initial': 2, 'stacks': 1, 'stacks_variance': 0.5}
+            }
+        })
+        assert data.drops_with_bonus('location', Items(a=1)) == \
+            Items(a=5, b=2)
+        # 2 + 1**2 * 2 + 2 * 1 * 2, and 2**2 * 0.5.
+        assert data.variance_with_bonus('location', Items(a=1, b=2)) == \
+            Items(a=8, b=2)
+
+class TestItemsArray:
+    def test_round_trip(self):
+        index = MaterialIndex()
+        items = [Items(a=1, b=0), Items(c=2.5), Items()]
+        batch = ItemsArray.stack(items, index)
+        assert batch.to_items() == items
+        assert ItemsArray.from_items(items[0], index).to_items() == items[0]
+
+    def test_algebra(self):
+        index = MaterialIndex()
+        first = Items(a=1, b=2)
+        second = Items(b=3, c=4)
+        batch = ItemsArray.stack([first, second], index)
+        late = ItemsArray.from_items(Items(d=5), index)
+
+        assert (batch[0] + batch[1]).to_items() == first + second
+        assert (batch[0] - batch[1]).to_items() == first - second
+        assert (-batch).to_items() == [-first, -second]
+        assert (batch + late).to_items() == [first + Items(d=5), 
+            second + Items(d=5)]
+        assert (batch * [2, 3]).to_items() == [Items(a=2, b=4), 
+            Items(b=9, c=12)]
+        assert batch.weighted_sum([1, 0]).to_items() == first
+        assert batch.sum().to_items() == first + second
+        assert list(batch.magnitude()) == [first.magnitude(), 
+            second.magnitude()]
+
+@pytest.fixture
+def summer_nodes():
+    path = os.path.join(os.path.dirname(__file__), '2018_07_summer')
+    with open(os.path.join(path, 'part_2_drops.json'), encoding='utf-8') as f:
+        data = DropsData(json.decoder.JSONDecoder().decode(f.read()))
+    with open(os.path.join(path, 'part_2_projects.json'), encoding='utf-8') as f:
+        projects = json.decoder.JSONDecoder().decode(f.read())
+
+    bonuses = [Items(blue=1), Items(gold=1), Items(silver=1), 
+        Items(oil=1), Items(cement=1)]
+    available = PartySetup(bonuses*5, [], bonuses)
+    nodes = data.optimise_drops(['underworld explosion', 
+        'fields explosion', 'coast explosion', 'cave explosion',
+        'city explosion'], available)
+    return nodes, projects
+
+class TestEventOptimiser:
+    def test_single_solve_matches_probing(self, summer_nodes):
+        nodes, projects = summer_nodes
+        targets = [Items(p['cost']) for group in projects for p in group]
+        targets.append(sum(targets, Items()))
+
+        probing = EventOptimiser(single_solve=False)
+        single = EventOptimiser(single_solve=True)
+        for opt in (probing, single):
+            opt.set_farming_nodes(nodes)
+
+        weights = [math.sqrt(sum(x**2 for x in drops.values())) 
+            for drops in nodes.values()]
+        for use_int in (True, False):
+            for target in targets:
+                results = []
+                for opt in (probing, single):
+                    opt.set_target(target)
+                    runs = opt._do_optimise(use_int)
+                    results.append((
+                        round(sum(runs), 6),
+                        round(sum(w*x for w, x in zip(weights, runs)), 6)
+                    ))
+                assert results[0] == results[1]
+
+    def test_run_cache(self, summer_nodes):
+        nodes, projects = summer_nodes
+        opt = EventOptimiser(cache_size=2)
+        opt.set_farming_nodes(nodes)
+
+        first = Items(projects[0][0]['cost'])
+        second = Items(projects[0][1]['cost'])
+        opt.set_target(first)
+        runs = opt.optimise_runs()
+        opt.set_target(Items(first))
+        assert opt.optimise_runs() == runs
+        assert opt.cache_info().hits == 1
+        assert opt.cache_info().misses == 1
+
+        opt.set_target(second)
+        opt.optimise_runs()
+        opt.set_farming_nodes(OrderedDict(reversed(list(nodes.items()))))
+        opt.set_target(first)
+        opt.optimise_runs()
+        assert opt.cache_info() == (1, 3, 2, 2)
+
+    def test_ap_costs(self):
+        nodes = OrderedDict((
+            ('expert', Items(iron=10)),
+            ('advanced', Items(iron=6)),
+        ))
+        for single_solve in (True, False):
+            opt = EventOptimiser(single_solve=single_solve)
+            opt.set_target(Items(iron=30))
+            opt.set_farming_nodes(nodes)
+            runs = opt.optimise_runs()
+            assert runs == {'expert': 3, 'advanced': 0}
+            assert opt.total_ap(runs) == 120
+
+            # fewer runs of the expensive node cost more AP.
+            opt.set_farming_nodes(nodes, {'advanced': 20})
+            runs = opt.optimise_runs()
+            assert runs == {'expert': 0, 'advanced': 5}
+            assert opt.total_ap(runs) == 100
+
+        opt.set_farming_nodes(nodes, 40.0)
+        assert opt.optimise_runs() == {'expert': 3, 'advanced': 0}
+        for bad in (0, 12.5):
+            with pytest.raises(ValueError):
+                opt.set_farming_nodes(nodes, {'advanced': bad})
+
+    def test_confidence(self):
+        nodes = OrderedDict((
+            ('a', Items(iron=10, stone=3)), 
+            ('b', Items(stone=8)),
+        ))
+        opt = EventOptimiser()
+        opt.set_target(Items(iron=200, stone=200))
+        opt.set_farming_nodes(nodes, 
+            variances={'a': Items(iron=16, stone=4), 'b': Items(stone=9)})
+
+        expected = opt.optimise_runs()
+        assert opt.success_probability(expected, seed=1) < 0.5
+        for confidence in (0.9, 0.99):
+            runs = opt.optimise_runs(confidence)
+            assert opt.success_probability(runs, seed=1) >= confidence
+            assert opt.total_ap(runs) > opt.total_ap(expected)
+        assert opt._remaining == Items(iron=200, stone=200)
+
+        # plain dict nodes which do not drop every needed material.
+        opt.set_farming_nodes({
+            'n1': {'mat1': 300}, 
+            'n2': {'mat2': 200, 'mat1': 100},
+        }, variances={'n1': {'mat1': 900}})
+        opt.set_target(Items(mat1=3000, mat2=200))
+        runs = opt.optimise_runs(0.9)
+        assert opt.success_probability(runs, seed=1) >= 0.9
+
+    def test_record_run(self):
+        opt = EventOptimiser()
+        opt.set_current(Items(iron=5))
+        opt.set_target(Items(iron=35, stone=20))
+        opt.set_farming_nodes(OrderedDict((
+            ('a', Items(iron=10)), 
+            ('b', Items(stone=10)),
+        )))
+        assert opt.optimise_runs() == {'a': 3, 'b': 2}
+
+        assert opt.record_run('a') == {'a': 2, 'b': 2}
+        assert opt.record_run('b', Items(stone=25)) == {'a': 2, 'b': 0}
+        assert opt.record_run('a', Items(iron=3)) == {'a': 2, 'b': 0}
+        assert opt._current == Items(iron=18, stone=25)
+
+    def test_joint_parties_beat_two_stage(self):
+        path = os.path.join(os.path.dirname(__file__), '2018_07_summer')
+        with open(os.path.join(path, 'part_1_drops.json')) as f:
+            data = DropsData(json.decoder.JSONDecoder().decode(f.read()))
+        available = PartySetup(
+            [Items(food=1), Items(water=1), Items(wood=1), Items(stone=1),
+                Items(iron=1)]*6,
+            [Items(food=1, water=1)]*5 + [Items(wood=1)],
+            [Items(food=2, water=1), Items(food=1, water=2), Items(wood=2),
+                Items(stone=2), Items(iron=2)]
+        )
+        locations = ['beach storm', 'forest storm', 
+            'jungle storm', 'field storm', 'cavern storm']
+        target = Items(iron=1500, stone=500, wood=500, food=500)
+
+        two_stage = EventOptimiser()
+        two_stage.set_farming_nodes(data.optimise_drops(locations, available))
+        two_stage.set_target(target)
+        joint = PartyEventOptimiser(data, available)
+        joint.set_locations(locations)
+        joint.set_target(target)
+
+        runs = joint.optimise_runs()
+        assert sum(runs.values()) == 22
+        assert sum(two_stage.optimise_runs().values()) == 23
+        assert all(joint.total_items(runs)[mat] >= num 
+            for mat, num in target.items())
+        for loc, party in joint.parties.items():
+            assert joint._farming_nodes[loc] == \
+                data.drops_with_party(loc, party)
+
+        # recording a run replans with the chosen parties.
+        parties = joint.parties
+        loc = next(loc for loc, n in runs.items() if n)
+        replanned = joint.record_run(loc)
+        assert joint.parties is parties
+        assert sum(replanned.values()) == 21
+
+    def test_party_confidence(self):
+        data = DropsData({
+            'location': {
+                'iron': {'initial': 10, 'stacks': 1, 'initial_variance': 4}
+            },
+            'fixed': {'stone': {'initial': 1, 'stacks': 0}},
+        })
+        opt = PartyEventOptimiser(data, PartySetup(servants=[Items(iron=1)]))
+        opt.set_locations(['location'], {'fixed': Items(stone=10)}, 
+            fixed_variances={'fixed': Items(stone=25)})
+        opt.set_target(Items(iron=550, stone=100))
+
+        expected = opt.optimise_runs()
+        assert expected == {'location': 50, 'fixed': 10}
+        runs = opt.optimise_runs(confidence=0.99)
+        assert runs['location'] > 50 and runs['fixed'] > 10
+        assert opt.success_probability(runs, seed=1) >= 0.99
+
 
 def _project(name, **materials):
     return {
@@ -79,7 +349,40 @@ def proj_opt_2():
 
 class TestProjOpt2:
 
-    @pytest.mark.skip(reason='Excessive resource usage required to pass.')
+    def test_parallel_matches_serial(self, proj_opt_2):
+        results = []
+        for workers in (1, 2):
+            random.seed(1)
+            proj_opt_2._workers = workers
+            results.append(proj_opt_2.optimise_projects(iterations=200))
+        assert results[0] == results[1]
+        assert results[0]['total_runs'] == 18
+
+    def test_pareto_projects(self, proj_opt_2):
+        opt = SummerProjectsOptimiser3(False)
+        opt.set_projects(proj_opt_2._all_projects[0])
+        opt.set_farming_nodes(proj_opt_2._all_farming_nodes[0])
+        cheapest = opt.optimise_projects()
+
+        front = opt.pareto_projects(max_extra_ap=200)
+        assert front[0]['ap'] == cheapest['ap']
+        assert front[-1]['ap'] <= cheapest['ap'] + 200
+        for a, b in zip(front, front[1:]):
+            assert a['ap'] < b['ap']
+            assert a['total_surplus'] < b['total_surplus']
+
+        capped = opt.pareto_projects(max_extra_ap=200, caps={'mat1': 0})
+        assert all(plan['surplus']['mat1'] == 0 for plan in capped)
+
+        # more AP at the dearer node never adds surplus.
+        opt.set_projects([[_project('Project', iron=30)]])
+        opt.set_farming_nodes(OrderedDict((
+            ('a', Items(iron=10)), 
+            ('b', Items(iron=1)),
+        )), {'a': 30, 'b': 40})
+        front = opt.pareto_projects(max_extra_ap=100)
+        assert [plan['ap'] for plan in front] == [90, 120, 150, 180]
+
     def test_optimiser_2(self):
         os.chdir(os.path.dirname(__file__) + '/2018_07_summer')
     
@@ -108,7 +411,7 @@ class TestProjOpt2:
         
         available = PartySetup(my_servants, my_ces, available_supports)
 
-        optimiser = SummerProjectsOptimiser2(chunked=True)
+        optimiser = SummerProjectsOptimiser3(chunked=True)
         
         farming_nodes_1 = data.optimise_drops(
             ['underworld advanced', 'fields advanced', 'coast advanced', 'cave advanced'],
@@ -129,5 +432,26 @@ class TestProjOpt2:
         optimiser.set_farming_nodes([farming_nodes_1, farming_nodes_2])
         output = optimiser.optimise_projects()
         print(json.encoder.JSONEncoder(indent=2).encode(output))
-        assert output[0]['total_runs'] + output[1]['total_runs'] == 25
+        assert output[0]['total_runs'] + output[1]['total_runs'] == 24
+
+
 
+class TestCampaignOptimiser:
+    def test_farms_early_for_later_chunks(self):
+        # only the first chunk's node drops stone, which the second needs.
+        optimiser = CampaignOptimiser()
+        optimiser.set_projects([
+            [[{'name': 'A', 'cost': {'iron': 2}}]],
+            [[{'name': 'B', 'cost': {'stone': 3, 'iron': 1}},
+              {'name': 'C', 'cost': {'stone': 5}}]],
+        ])
+        optimiser.set_farming_nodes([
+            {'quarry': Items(iron=1, stone=1)},
+            {'mine': Items(iron=1)},
+        ], [30, 20])
+        output = optimiser.optimise_projects(Items(stone=1))
+        assert output[0]['runs'] == {'quarry': 2}
+        assert output[1]['projects'] == ['B']
+        assert output[1]['runs'] == {'mine': 1}
+        assert output[0]['ap'] + output[1]['ap'] == 80
+        assert output[1]['remaining'] == Items(iron=0, stone=0)
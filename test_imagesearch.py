@@ -0,0 +1,161 @@
+import os
+import pytest
+import sys
+import types
+
+import numpy as np
+
+cv2 = pytest.importorskip('cv2')
+
+# pyautogui needs a display, and these tests never touch the real screen.
+try:
+    import pyautogui
+except Exception:
+    sys.modules['pyautogui'] = types.ModuleType('pyautogui')
+
+import imagesearch
+
+
+def _result(peaks, shape=(100, 100)):
+    res = np.zeros(shape, dtype=np.float32)
+    for x, y, score in peaks:
+        res[y, x] = score
+    return res
+
+class TestNonMaxSuppression:
+    def test_distinct_peaks(self):
+        res = _result([(10, 10, 0.9), (12, 11, 0.85), (50, 20, 0.95)])
+        found = imagesearch.non_max_suppression(res, 0.8, min_distance=10)
+        assert [(x, y) for x, y, score in found] == [(50, 20), (10, 10)]
+        assert found[0][2] == pytest.approx(0.95)
+
+    def test_plateau_is_one_match(self):
+        res = np.zeros((100, 100), dtype=np.float32)
+        res[40:50, 60:70] = 0.85
+        res[45, 65] = 0.9
+        assert imagesearch.non_max_suppression(res, 0.8, 30) == \
+            [(65, 45, pytest.approx(0.9))]
+
+    def test_threshold(self):
+        res = _result([(10, 10, 0.79), (50, 50, 0.8)])
+        found = imagesearch.non_max_suppression(res, 0.8)
+        assert [(x, y) for x, y, score in found] == [(50, 50)]
+        assert imagesearch.non_max_suppression(res, 0.95) == []
+
+    def test_suppress_spacing_and_order(self):
+        xs = np.array([0, 3, 1, 40])
+        ys = np.array([0, 4, 1, 0])
+        scores = np.array([0.9, 0.8, 0.95, 0.85])
+        assert imagesearch.suppress(xs, ys, scores, 5) == [2, 3]
+        # (3, 4) is just over 3 pixels from the best point.
+        assert imagesearch.suppress(xs, ys, scores, 3) == [2, 3, 1]
+        assert imagesearch.suppress(xs, ys, scores, 1) == [2, 0, 3, 1]
+
+    def test_count(self, tmp_path, monkeypatch):
+        rng = np.random.RandomState(0)
+        template = rng.randint(0, 255, (20, 30)).astype(np.uint8)
+        screen = np.zeros((120, 200), dtype=np.uint8)
+        screen[10:30, 20:50] = template
+        screen[70:90, 120:150] = template
+        path = str(tmp_path / 'card.png')
+        cv2.imwrite(path, template)
+
+        monkeypatch.setattr(imagesearch.pyautogui, 'screenshot',
+            lambda: cv2.cvtColor(screen, cv2.COLOR_GRAY2RGB), raising=False)
+        imagesearch.frames.invalidate()
+        assert imagesearch.imagesearch_count(path) == 2
+        found = imagesearch.imagesearch_all(path)
+        assert sorted((x, y) for x, y, score in found) == [(20, 10), (120, 70)]
+
+class TestImageSearchRoi:
+    @pytest.fixture
+    def screen(self, tmp_path, monkeypatch):
+        rng = np.random.RandomState(0)
+        template = rng.randint(0, 255, (20, 30)).astype(np.uint8)
+        path = str(tmp_path / 'button.png')
+        cv2.imwrite(path, template)
+
+        screen = np.zeros((120, 200), dtype=np.uint8)
+        monkeypatch.setattr(imagesearch.pyautogui, 'screenshot',
+            lambda: cv2.cvtColor(screen, cv2.COLOR_GRAY2RGB), raising=False)
+        monkeypatch.setattr(imagesearch, 'regions', 
+            imagesearch.RegionProfiles())
+        monkeypatch.setattr(imagesearch, 'gate', imagesearch.ChangeGate())
+
+        full_searches = []
+        search = imagesearch.imagesearch
+        def counted(*args, **kwargs):
+            full_searches.append(args[0])
+            return search(*args, **kwargs)
+        monkeypatch.setattr(imagesearch, 'imagesearch', counted)
+
+        def search_roi():
+            imagesearch.frames.invalidate()
+            return tuple(imagesearch.imagesearch_roi(path))
+
+        screen[10:30, 20:50] = template
+        assert search_roi() == (20, 10)
+        assert imagesearch.regions.region(path) == (0, 0, 70, 50)
+        assert len(full_searches) == 1
+        return screen, template, search_roi, full_searches
+
+    def test_found_in_region(self, screen):
+        screen, template, search_roi, full_searches = screen
+        screen[10:30, 20:50] = 0
+        screen[15:35, 25:55] = template
+        assert search_roi() == (25, 15)
+        assert len(full_searches) == 1
+
+    def test_unchanged_miss_skips_fallback(self, screen):
+        screen, template, search_roi, full_searches = screen
+        screen[10:30, 20:50] = 0
+        assert search_roi() == (-1, -1)
+        assert len(full_searches) == 2
+        assert search_roi() == (-1, -1)
+        assert len(full_searches) == 2
+
+        # outside the region, so only seen once the region changes.
+        screen[70:90, 120:150] = template
+        assert search_roi() == (-1, -1)
+        assert len(full_searches) == 2
+
+    def test_changed_miss_searches_again(self, screen):
+        screen, template, search_roi, full_searches = screen
+        screen[10:30, 20:50] = 0
+        assert search_roi() == (-1, -1)
+        assert len(full_searches) == 2
+
+        screen[70:90, 120:150] = template
+        screen[10:30, 20:50] = 255
+        assert search_roi() == (120, 70)
+        assert len(full_searches) == 3
+
+
+def test_pyramid_accuracy(tmp_path):
+    images = os.path.join(os.path.dirname(__file__), 'images')
+    positions = [
+        {'attack.png': (700, 450), 'close.png': (880, 20), 
+            'next.png': (100, 460)},
+        {'skill_np.png': (400, 400), 'battle_menu.png': (850, 200), 
+            'please_tap.png': (300, 50)},
+    ]
+    rng = np.random.RandomState(0)
+    screenshots = []
+    for i, pasted in enumerate(positions):
+        screen = cv2.GaussianBlur(
+            rng.randint(0, 255, (540, 960)).astype(np.uint8), (0, 0), 3)
+        for name, (x, y) in pasted.items():
+            template = cv2.imread(os.path.join(images, name), 0)
+            h, w = template.shape
+            screen[y:y+h, x:x+w] = template
+        path = str(tmp_path / ('screen_%d.png' % i))
+        cv2.imwrite(path, screen)
+        screenshots.append(path)
+
+    # each screenshot has half the templates, so both hits and misses count.
+    templates = [os.path.join(images, name) 
+        for pasted in positions for name in pasted]
+    stats = imagesearch.pyramid_accuracy(screenshots, templates, 3)
+    assert stats['searches'] == 12
+    assert stats['agreed'] == 12
+    assert stats['max_score_error'] < 0.05